@@ -1,11 +1,20 @@
 ### Code provided by Tyron Pretorius, contact me using tyron@theworkflowpro.com if you have any questions
 
-import requests
 import json
 from datetime import datetime, timedelta, timezone
 import time
 import pandas as pd
 from io import StringIO
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+from export_jobs import ExportJobs
+import http_session
+from quota_ledger import MB, Estimate, get_ledger, preflight
+from token_provider import TokenProvider
 
 base_url = 'https://xxx-xxx-xxx.mktorest.com'
 client_id = 'xxx'
@@ -13,58 +22,33 @@ client_secret = 'xxx'
 time_frame = 90 #number of days in the past for which you want to extract data
 file_path = '/Users/tyronpretorius/Downloads/best_send_time_raw_20230926.csv'
 activityIds = [7,10]
+est_job_mb = 50 #size of one 31 day export file assumed until the quota ledger has seen a real one
 
-def getToken ():
-    response = requests.get(base_url+'/identity/oauth/token?grant_type=client_credentials&client_id='+client_id+'&client_secret='+client_secret)
-
-    print(response.text)
-
-    temp = json.loads(response.text)
-    token = temp['access_token']
-    remaining = temp['expires_in']
+# one access token shared by the threads and processes using this API user, the next token is fetched in the
+# background as soon as the current one expires so the calls below never wait for it (see token_provider.py)
+tokens = TokenProvider(base_url, client_id, client_secret)
 
-    return [token, remaining]
+# the export jobs are recorded by their filter so a job is never created twice for the same time range, and a create
+# or enqueue call that timed out is checked instead of being sent again (see export_jobs.py)
+jobs = ExportJobs(base_url, file_path + '.jobs.json')
 
 def createJob(startAt, endAt, activityTypeIds, token):
 
-    url = base_url + "/bulk/v1/activities/export/create.json"
-
-    payload = json.dumps({
-        "format": 'CSV',
-        "filter": {
-            "createdAt": {
-                "startAt": startAt,
-                "endAt": endAt
-            },
-            "activityTypeIds": activityTypeIds
-        }
-    })
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer ' + token
+    export_filter = {
+        "createdAt": {
+            "startAt": startAt,
+            "endAt": endAt
+        },
+        "activityTypeIds": activityTypeIds
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    print(response.text)
+    job_id = jobs.create(export_filter, token)
 
-    temp = json.loads(response.text)
-    job_id = temp["result"][0]["exportId"]
+    print(job_id)
     return job_id
 
 def enqueueJob(jobId, token):
-    url = base_url + "/bulk/v1/activities/export/"+jobId+"/enqueue.json"
-
-    payload = ""
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer ' + token
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    print(response.text)
+    jobs.enqueue(jobId, token)
 
 def pollJob(jobId, token):
 
@@ -76,7 +60,7 @@ def pollJob(jobId, token):
         'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = http_session.request("GET", url, headers=headers, data=payload)
 
     print(response.text)
 
@@ -93,7 +77,7 @@ def getJobData(jobId, token):
         'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = http_session.request("GET", url, headers=headers, data=payload)
 
     #print(response.text)
 
@@ -131,28 +115,34 @@ def splitTimeFrame(lookBackDays, maxDelta):
 
     return (time_pairs)
 
-def createMultipleJobs(time_pairs, token):
+#the calls and export bytes one job is expected to spend: create, enqueue, about 10 status polls and the file
+#download, whose size is the average of the files downloaded before (see quota_ledger.py)
+def estimateJob():
+    file_bytes = get_ledger().average_bytes('/bulk/v1/activities/export/{id}/file.json')
+    return Estimate(calls=13, export_bytes=file_bytes or est_job_mb * MB)
+
+def createMultipleJobs(time_pairs):
 
     job_ids = []
     for start_time, end_time in time_pairs:
-        job_ids.append(createJob(start_time, end_time, activityIds, token))
+        job_ids.append(createJob(start_time, end_time, activityIds, tokens.get()))
 
     return job_ids
 
-def enqueueMultipleJobs(job_ids, token):
+def enqueueMultipleJobs(job_ids):
 
     for j in job_ids:
-        enqueueJob(j, token)
+        enqueueJob(j, tokens.get())
 
-def waitWhilePolling(job_ids, token):
+def waitWhilePolling(job_ids):
 
     last_id = job_ids[-1]
-    status = pollJob(last_id,token)
+    status = pollJob(last_id, tokens.get())
     while status != "Completed":
         time.sleep(30)
-        status = pollJob(last_id, token)
+        status = pollJob(last_id, tokens.get())
 
-def getMultipleJobs(job_ids,token):
+def getMultipleJobs(job_ids):
     headers = [
         'marketoGUID',
         'leadId',
@@ -167,7 +157,7 @@ def getMultipleJobs(job_ids,token):
     df = pd.DataFrame(columns=headers)
 
     for j in job_ids:
-        raw_data = getJobData(j, token)
+        raw_data = getJobData(j, tokens.get())
         new_data = pd.read_csv(StringIO(raw_data))
         df = pd.concat([df, new_data], ignore_index=True)
 
@@ -178,23 +168,19 @@ if __name__ == '__main__':
     #Get start and end time pairs needed to create each job
     time_pairs = splitTimeFrame(time_frame, 31)
 
-    #Get an access token and make sure it has more than 6o secs of life
-    remaining = 0
-    while remaining < 60 :
-        time.sleep(remaining)  # if the remaining time is less than 60 secs then wait for the token to expire before getting a new one
-        temp = getToken()
-        token = temp[0]
-        remaining = temp[1]
+    #refuse to start when the jobs would spend more calls or export MB than are left of today's quota, half of the
+    #time frame is no use so the run is not split
+    preflight([estimateJob() for pair in time_pairs], split=False)
 
     #create jobs for each time pair
-    job_ids = createMultipleJobs(time_pairs, token)
+    job_ids = createMultipleJobs(time_pairs)
 
     #queue jobs & wait until job data is ready
-    enqueueMultipleJobs(job_ids, token)
-    waitWhilePolling(job_ids,token)
+    enqueueMultipleJobs(job_ids)
+    waitWhilePolling(job_ids)
 
     #get the job data for each job and join together
-    df = getMultipleJobs(job_ids, token)
+    df = getMultipleJobs(job_ids)
 
     #write the data to a CSV
     df.to_csv(file_path, index=False)
@@ -1,7 +1,12 @@
 import pandas as pd
-import requests
-import json
-import time
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+from token_provider import TokenProvider
 
 base_url = 'https://xxx-xxx-xxx.mktorest.com'
 client_id = 'xxx'
@@ -10,35 +15,16 @@ activityIds = [7,10]
 sinceDate="2023-09-28T00:00:00"
 file_path = '/Users/tyronpretorius/Downloads/best_send_time_raw_20230928.csv'
 
-# get an access token
-def getToken ():
-    response = requests.get(base_url+'/identity/oauth/token?grant_type=client_credentials&client_id='+client_id+'&client_secret='+client_secret)
-
-    print(response.text)
-
-    temp = json.loads(response.text)
-    token = temp['access_token']
-    remaining = temp['expires_in']
-
-    return [token, remaining]
-
-# get an access token and make sure it has more than 6o secs of life
-def checkTokenLife():
-    remaining = 0
-    while remaining < 60:
-        time.sleep(remaining)  # if the remaining time is less than 60 secs then wait for the token to expire before getting a new one
-        temp = getToken()
-        token = temp[0]
-        remaining = temp[1]
-
-    return token
+# one access token shared by the threads and processes using this API user, the next token is fetched in the
+# background as soon as the current one expires so the calls below never wait for it (see token_provider.py)
+tokens = TokenProvider(base_url, client_id, client_secret)
 
 #get the starting token needed to page through activities since the start date
 def getStartPage(token, sinceDate):
     url= base_url+'/rest/v1/activities/pagingtoken.json'
     params={'access_token': token,
             'sinceDatetime': sinceDate}
-    response=requests.get(url=url,params=params)
+    response=http_session.get(url=url,params=params)
     data=response.json()
     print(data)
     return data['nextPageToken']
@@ -49,7 +35,7 @@ def pagenation(token, nextPageToken):
     params={'access_token': token,
             'nextPageToken': nextPageToken,
             'activityTypeIds': activityIds}
-    response=requests.get(url=url,params=params)
+    response=http_session.get(url=url,params=params)
     data=response.json()
     print(data)
     return data
@@ -59,8 +45,8 @@ if __name__ == '__main__':
     #give more an initial value so we enter the while loop
     more=True
 
-    # get a token with more than 60 secs of life
-    token = checkTokenLife()
+    # get a valid access token
+    token = tokens.get()
 
     # get the starting token needed to page through activities since the start date
     nextPageToken = getStartPage(token, sinceDate)
@@ -71,8 +57,8 @@ if __name__ == '__main__':
     #iterate through each page and add the activity info to the list
     while more:
 
-        #get a token with more than 60 secs of life
-        token = checkTokenLife()
+        #get a valid access token
+        token = tokens.get()
 
         #get all the information from this page
         data = pagenation(token, nextPageToken)
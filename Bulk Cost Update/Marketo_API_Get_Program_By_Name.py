@@ -2,7 +2,13 @@
 #this is a simple function that makes a call to the get program by name endpoint to get the information
 #for the program name being queried
 
-import requests
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
 
 def getProgramByName (base_url, token, name):
     url = base_url + "/rest/asset/v1/program/byName.json?name=" + name
@@ -12,6 +18,6 @@ def getProgramByName (base_url, token, name):
       'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("GET", url, headers=headers, data = payload)
+    response = http_session.request("GET", url, headers=headers, data = payload)
 
     return (response.text)
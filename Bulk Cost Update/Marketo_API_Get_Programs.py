@@ -0,0 +1,44 @@
+#https://developers.marketo.com/rest-api/assets/programs/#browse
+#this function crawls the browse programs endpoint, which returns up to 200 programs per call, by increasing the
+#offset until a page comes back short or empty. It returns every program in the instance, so looking up hundreds of
+#programs by name only takes a few calls instead of one getProgramByName call per program
+
+import json
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+
+#the largest page the browse endpoint returns
+max_return = 200
+
+def getPrograms (base_url, token):
+    url = base_url + "/rest/asset/v1/programs.json"
+
+    headers = {
+      'Authorization': 'Bearer ' + token
+    }
+
+    programs = []
+    offset = 0
+    while True:
+        params = {'maxReturn': max_return, 'offset': offset}
+        response = http_session.request("GET", url, headers=headers, params=params)
+
+        data = json.loads(response.text)
+        if not data.get('success'):
+            raise RuntimeError('browsing the programs failed at offset ' + str(offset) + ': ' + response.text)
+
+        #past the last program Marketo answers with a warning ("No assets found ...") and no result
+        page = data.get('result') or []
+        programs.extend(page)
+        if len(page) < max_return:
+            return programs
+        offset += max_return
+
+#index the programs by name so that each name is resolved locally to the program's (id, createdAt)
+def indexPrograms (programs):
+    return {program['name']: (str(program['id']), program['createdAt']) for program in programs}
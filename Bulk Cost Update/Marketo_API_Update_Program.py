@@ -7,7 +7,13 @@
 # kwargs magic variable is used to pass keyworded arguments to the function, which can then be accessed
 # inside the function and stored in the payload by referencing their respective keys
 
-import requests
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
 
 def updateProgram (base_url,token, pid, **kwargs):
 
@@ -22,6 +28,6 @@ def updateProgram (base_url,token, pid, **kwargs):
         'Authorization': authorization
         }
 
-    response = requests.request("POST", url, data=payload, headers=headers)
+    response = http_session.request("POST", url, data=payload, headers=headers)
 
     return (response.text)
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+
+import Priority
+from AppendDict import appendDict
+from ClusterLeads import clusterLeads
+from MergePlan import planGroup
+import UpdateBatcher
+
+#benchmark the CPU side of BulkMerge.py on synthetic lead exports with all API calls stubbed out:
+# - grouping: clusterLeads on the unsorted export with the blocking keys and group size cap used by BulkMerge.py
+#   (and the original sorted appendDict walk for comparison)
+# - resolution: planGroup i.e. resolveGroup + Priority.ruler for every group, with the time spent in each rule
+# - batching: queueing the winning values in the UpdateBatcher and flushing them against a stubbed createUpdateLead
+#the peak memory of the resolution phase is measured with tracemalloc in a separate pass so it does not skew the times
+
+############ Updates Needed Here #############
+
+#number of rows in each synthetic export
+sizes = [10000, 100000, 1000000]
+
+#distribution of the number of leads sharing an email address {group size: probability}, size 1 means no duplicate
+group_sizes = {1: 0.55, 2: 0.3, 3: 0.1, 4: 0.03, 8: 0.02}
+
+#the keys the duplicates are clustered by and the largest group that is merged, as in BulkMerge.py
+blocking = ['email', 'plus_address', 'sfdcLeadId', 'mcUserId__c']
+max_group_size = 10
+
+#the original appendDict walk builds a dict per row, so it is only run up to this many rows
+legacy_max_rows = 100000
+
+#set to a file path to also write the results as JSON
+results_file = None
+
+seed = 7
+
+#############################################
+
+fields = [
+    'id', 'sfdcLeadId', 'email', 'createdAt', 'firstName', 'lastName', 'company', 'title', 'website',
+    'country', 'mcUserId__c', 'Querystring__c', 'leadSource', 'Lead_Source_Detail__c',
+    'utm_source__c', 'utm_medium__c', 'utm_campaign__c', 'leadScore', 'leadStatus',
+    'Lead_Status__c', 'Lifecycle_Stage_Person__c', 'unsubscribed', 'MC_Account_Blocked__c',
+]
+
+#pick a value from a pool for every row, with a share of empty values
+def column(rng, n, pool, empty=0.2):
+    values = np.array(pool, dtype=object)[rng.integers(0, len(pool), n)]
+    values[rng.random(n) < empty] = None
+    return values
+
+#an id per person, so the ids only link leads that are already duplicates by email. A shared pool of ids would
+#chain most of the export into one cluster, which clusterLeads reports as oversized
+def ids(prefix, person, rng, empty):
+    values = np.char.add(prefix, person.astype(str)).astype(object)
+    values[rng.random(len(person)) < empty] = None
+    return values
+
+#build a synthetic export of n rows in random order, the number of leads per email follows group_sizes and some
+#of the duplicates differ by case or whitespace
+def syntheticExport(n, rng):
+    sizes_ = np.array(list(group_sizes.keys()))
+    weights = np.array(list(group_sizes.values()), dtype=float)
+    weights = weights / weights.sum()
+    per_email = rng.choice(sizes_, size=n, p=weights)
+    per_email = per_email[:np.searchsorted(np.cumsum(per_email), n) + 1]
+    email_index = np.repeat(np.arange(len(per_email)), per_email)[:n]
+
+    emails = np.char.add(np.char.add('lead', email_index.astype(str)), '@example.com').astype(object)
+    upper = rng.random(n) < 0.1
+    emails[upper] = [e.upper() for e in emails[upper]]
+    padded = rng.random(n) < 0.05
+    emails[padded] = [' ' + e + ' ' for e in emails[padded]]
+
+    created = np.datetime64('2015-01-01T00:00:00') + rng.integers(0, 10 * 365 * 86400, n).astype('timedelta64[s]')
+    created = np.char.add(np.datetime_as_string(created, unit='s').astype(str), 'Z')
+
+    leadScore = rng.integers(-50, 200, n).astype(float)
+    leadScore[rng.random(n) < 0.2] = np.nan
+
+    df = pd.DataFrame({
+        'id': rng.permutation(n) + 1000000,
+        'sfdcLeadId': ids('00Q', email_index, rng, empty=0.7),
+        'email': emails,
+        'createdAt': created,
+        'firstName': column(rng, n, ['Ann', 'Bob', 'unknown', 'N/A', 'Cleo', '[not provided]']),
+        'lastName': column(rng, n, ['Smith', 'Jones', 'empty', 'Lee']),
+        'company': column(rng, n, ['Acme', 'Globex', 'Unknown', 'Initech']),
+        'title': column(rng, n, ['CEO', 'Engineer', 'n/a']),
+        'website': column(rng, n, ['acme.com', 'globex.net', 'initech.org', 'foo.io', 'unknown']),
+        'country': column(rng, n, ['United States', 'USA', 'Canada', 'Germany']),
+        'mcUserId__c': ids('', email_index, rng, empty=0.5),
+        'Querystring__c': column(rng, n, ['utm_source=a', 'gclid=1']),
+        'leadSource': column(rng, n, Priority.priority_dict['leadSource'] + ['Other']),
+        'Lead_Source_Detail__c': column(rng, n, ['Detail A', 'Detail B']),
+        'utm_source__c': column(rng, n, ['google', 'facebook', 'linkedin']),
+        'utm_medium__c': column(rng, n, ['cpc', 'social']),
+        'utm_campaign__c': column(rng, n, ['brand', 'retargeting']),
+        'leadScore': leadScore,
+        'leadStatus': column(rng, n, Priority.priority_dict['leadStatus']),
+        'Lead_Status__c': column(rng, n, Priority.priority_dict['Lead_Status__c']),
+        'Lifecycle_Stage_Person__c': column(rng, n, Priority.priority_dict['Lifecycle_Stage_Person__c']),
+        'unsubscribed': column(rng, n, [True, False], empty=0),
+        'MC_Account_Blocked__c': column(rng, n, [True, False], empty=0),
+    })
+
+    return df.iloc[rng.permutation(n)].reset_index(drop=True)
+
+#the original BulkMerge.py grouping: sort by email and walk the rows with appendDict
+def legacyGrouping(df):
+    raw_list = df.sort_values('email').where(df.notnull(), None).to_dict(orient='records')
+    groups = 0
+    i = 0
+    while i < len(raw_list):
+        field_dict = dict.fromkeys(fields, [])
+        appendDict(field_dict, raw_list[i])
+        j = i + 1
+        while j < len(raw_list) and raw_list[i]['email'] == raw_list[j]['email']:
+            appendDict(field_dict, raw_list[j])
+            j = j + 1
+        i = j
+        groups += 1
+    return groups
+
+#wrap every rule in Priority.rules to add up the time spent in it and the number of calls
+def timeRules():
+    rule_times = defaultdict(float)
+    rule_calls = defaultdict(int)
+    original = dict(Priority.rules)
+
+    def timed(line, rule):
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return rule(*args)
+            finally:
+                rule_times[line] += time.perf_counter() - start
+                rule_calls[line] += 1
+        return wrapper
+
+    for line, rule in original.items():
+        Priority.rules[line] = timed(line, rule)
+
+    return original, rule_times, rule_calls
+
+#stub for createUpdateLead that marks every record as updated
+def stubCreateUpdateLead(base_url, token, lead_dict, limiter=None):
+    return json.dumps({'success': True, 'result': [{'id': x['id'], 'status': 'updated'} for x in lead_dict]})
+
+def benchmark(n, rng):
+    result = {'rows': n}
+
+    df = syntheticExport(n, rng)
+
+    start = time.perf_counter()
+    groups, oversized = clusterLeads(df, fields, blocking, max_size=max_group_size)
+    result['grouping_secs'] = time.perf_counter() - start
+    result['groups'] = len(groups)
+    result['oversized'] = len(oversized)
+    result['groups_per_sec_grouping'] = len(groups) / result['grouping_secs']
+
+    if n <= legacy_max_rows:
+        start = time.perf_counter()
+        legacyGrouping(df)
+        result['legacy_grouping_secs'] = time.perf_counter() - start
+
+    #resolveGroup converts the ids in place, so every pass works on its own copy of the groups
+    copies = [{line: list(values) for line, values in g.items()} for g in groups]
+    original, rule_times, rule_calls = timeRules()
+    try:
+        start = time.perf_counter()
+        plans = [planGroup(g) for g in copies]
+        result['resolution_secs'] = time.perf_counter() - start
+    finally:
+        Priority.rules.update(original)
+    result['groups_per_sec_resolution'] = len(groups) / result['resolution_secs']
+    result['rule_secs'] = {line: rule_times[line] for line in sorted(rule_times, key=rule_times.get, reverse=True)}
+    result['rule_calls'] = dict(rule_calls)
+
+    #untimed resolution pass under tracemalloc for the peak memory of the resolution phase
+    copies = [{line: list(values) for line, values in g.items()} for g in groups]
+    tracemalloc.start()
+    [planGroup(g) for g in copies]
+    result['resolution_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+
+    UpdateBatcher.createUpdateLead = stubCreateUpdateLead
+    batcher = UpdateBatcher.UpdateBatcher('http://stub')
+    start = time.perf_counter()
+    calls = 0
+    for plan in plans:
+        if batcher.add(plan['group'], plan['final']):
+            batcher.flush('stub')
+            calls += 1
+    while len(batcher) > 0:
+        batcher.flush('stub')
+        calls += 1
+    result['batching_secs'] = time.perf_counter() - start
+    result['update_calls'] = calls
+
+    return result
+
+def report(result):
+    print('\n' + '=' * 60)
+    print(f"{result['rows']:,} rows -> {result['groups']:,} duplicate groups, {result['oversized']:,} oversized")
+    print('=' * 60)
+    print(f"grouping:   {result['grouping_secs']:.3f}s ({result['groups_per_sec_grouping']:,.0f} groups/sec)")
+    if 'legacy_grouping_secs' in result:
+        print(f"  original sorted appendDict walk: {result['legacy_grouping_secs']:.3f}s")
+    print(f"resolution: {result['resolution_secs']:.3f}s ({result['groups_per_sec_resolution']:,.0f} groups/sec), "
+          f"peak memory {result['resolution_peak_mb']:.1f} MB")
+    for line, secs in result['rule_secs'].items():
+        print(f"  {line:<28}{secs:8.3f}s  {result['rule_calls'][line]:>10,} calls")
+    print(f"batching:   {result['batching_secs']:.3f}s ({result['update_calls']:,} stubbed update calls)")
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        result = benchmark(n, rng)
+        report(result)
+        results.append(result)
+
+    if results_file:
+        with open(results_file, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,67 @@
+import re
+
+import pandas as pd
+
+import Priority
+from GroupLeads import emailKey
+
+#finds duplicate candidates that do not share a byte-identical email address. Instead of comparing every pair of
+#leads, each lead is given a few blocking keys and only leads that share a key are candidates. Every key is computed
+#for the whole column at once and factorized, which is an inverted index from key to the rows that share it, so the
+#whole stage is near-linear in the number of rows.
+#The available blocking keys are:
+# email        - the email address ignoring case and surrounding whitespace
+# plus_address - the email address with any plus-addressing tag removed e.g. john+news@acme.com -> john@acme.com
+# name_company - firstName + lastName + company, ignoring case, punctuation and extra whitespace
+# name_website - firstName + lastName + the domain of the website e.g. https://www.acme.com/about -> acme.com
+# sfdcLeadId   - the Salesforce id the lead is synced to
+# mcUserId__c  - the product user id
+#the leads that share any of the keys are clustered into one group by ClusterLeads.py. The name based keys match
+#different people with the same name at the same company, so the plan mode of BulkMerge.py should be used to review
+#the groups they produce before merging
+
+#replace the null-like values (see priority_rules.json) with NA so they never match each other
+def notNullLike(values):
+    pattern = '|'.join(re.escape(x) for x in Priority.null_like)
+    values = values.astype('string').str.strip()
+    return values.mask((values == '') | values.str.contains(pattern, case=False, regex=True))
+
+#lower case, drop punctuation and collapse whitespace in a name or company
+def normalizeName(values):
+    values = notNullLike(values).str.lower().str.replace(r'[^\w\s]', '', regex=True)
+    values = values.str.replace(r'\s+', ' ', regex=True).str.strip()
+    return values.mask(values == '')
+
+def emailBlock(df):
+    return emailKey(df['email'])
+
+def plusAddressBlock(df):
+    parts = emailKey(df['email']).str.extract(r'^([^@+]+)(?:\+[^@]*)?@(.+)$')
+    return parts[0] + '@' + parts[1]
+
+def nameCompanyBlock(df):
+    return normalizeName(df['firstName']) + '|' + normalizeName(df['lastName']) + '|' + normalizeName(df['company'])
+
+def nameWebsiteBlock(df):
+    domain = notNullLike(df['website']).str.lower().str.extract(r'^(?:[a-z]+://)?(?:www\.)?([^/:?#\s]+)')[0]
+    return normalizeName(df['firstName']) + '|' + normalizeName(df['lastName']) + '|' + domain
+
+#return a block function for an identity field whose values are ids that are shared by the same person only
+def idBlock(field):
+    def block(df):
+        return notNullLike(df[field])
+    return block
+
+blocking_keys = {
+    'email': emailBlock,
+    'plus_address': plusAddressBlock,
+    'name_company': nameCompanyBlock,
+    'name_website': nameWebsiteBlock,
+    'sfdcLeadId': idBlock('sfdcLeadId'),
+    'mcUserId__c': idBlock('mcUserId__c'),
+}
+
+#return the integer codes of one blocking key for every row, -1 when the row has no value for the key
+def blockCodes(df, key):
+    codes, uniques = pd.factorize(blocking_keys[key](df))
+    return codes
@@ -1,201 +1,305 @@
 import pandas as pd
-import numbers
+import pyarrow.parquet as pq
 from datetime import datetime
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
-import time
+import sys
 
-from Priority import ruler
-from AppendDict import appendDict
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+from log_sink import JsonLogSink, parse_response
+from quota_ledger import preflight
+from api_metrics import get_metrics
+
+from GroupLeads import streamGroups
+from ClusterLeads import clusterLeads
+from MergePlan import planGroup, writePlan, readPlan
+from RateLimiter import RateLimiter, SharedRateLimiter
+from MergeJournal import MergeJournal, groupKey
+from WorkQueue import WorkQueue
 from Marketo_API_Get_Auth import getToken
-from Marketo_API_Merge import mergeLead
-from Marketo_API_Create_Update_Lead import createUpdateLead
+from Marketo_API_Merge import mergeLead, mergeOutcome
+from UpdateBatcher import UpdateBatcher
+from SurvivorResolver import SurvivorResolver
+from UpdateDiff import changedFields
+from MergeQuota import estimateLeads, estimatePendingUpdates, estimatePlanFile
 
 base_url = "https://###-xxx-###.mktorest.com"
 
-#Read in the lead information from a CSV and store in a dictionary
-#The email address column must be sorted
-raw_list = pd.read_csv('/home/tyron/Downloads/May Merging - Copy From Here.csv')
-raw_list = raw_list.where(raw_list.notnull(), None)
-raw_list = raw_list.to_dict(orient='records')
-
-#field_dict will store the values for each lead for each field of interest
-field_dict = {
-    'id': [], 'sfdcLeadId':[], 'email': [], 'createdAt': [], 'firstName': [], 'lastName': [], 'company': [], 'title': [], 'website': [],
-    'country': [], 'mcUserId__c': [], 'Querystring__c': [], 'leadSource': [], 'Lead_Source_Detail__c': [],
-    'utm_source__c': [], 'utm_medium__c': [], 'utm_campaign__c': [], 'leadScore': [], 'leadStatus': [],
-    'Lead_Status__c': [], 'Lifecycle_Stage_Person__c': [], 'unsubscribed': [], 'MC_Account_Blocked__c': [],
-}
-
-#final_dict will store the winning values for each field from the input lead values
-final_dict = {
-    'id': [], 'sfdcLeadId':[], 'email': [], 'createdAt': [], 'firstName': [], 'lastName': [], 'company': [], 'title': [], 'website': [],
-    'country': [], 'mcUserId__c': [], 'Querystring__c': [], 'leadSource': [], 'Lead_Source_Detail__c': [],
-    'utm_source__c': [], 'utm_medium__c': [], 'utm_campaign__c': [], 'leadScore': [], 'leadStatus': [],
-    'Lead_Status__c': [], 'Lifecycle_Stage_Person__c': [], 'unsubscribed': [], 'MC_Account_Blocked__c': []
-}
-
-count = 0
-update_leads = ['']
-i= 0
-
-#create a log file
+#fields of interest whose values are compared across the duplicate leads
+fields = [
+    'id', 'sfdcLeadId', 'email', 'createdAt', 'firstName', 'lastName', 'company', 'title', 'website',
+    'country', 'mcUserId__c', 'Querystring__c', 'leadSource', 'Lead_Source_Detail__c',
+    'utm_source__c', 'utm_medium__c', 'utm_campaign__c', 'leadScore', 'leadStatus',
+    'Lead_Status__c', 'Lifecycle_Stage_Person__c', 'unsubscribed', 'MC_Account_Blocked__c',
+]
+
+input_file = '/home/tyron/Downloads/May Merging - Copy From Here.csv'
+plan_file = input_file + '.plan.parquet'
+queue_file = input_file + '.queue.sqlite'
+
+#'run'          - group and resolve the leads from input_file and merge them
+#'plan'         - group and resolve the leads from input_file and only write the merge plan (winner id, loser ids and
+#                 final field values of every group) to plan_file without making any API calls, so it can be reviewed
+#'execute_plan' - merge the groups streamed from a plan written by 'plan' without resolving anything again
+#'enqueue'      - group and resolve the leads from input_file and add the groups to the work queue in queue_file
+#'worker'       - merge the groups claimed from queue_file, any number of workers can be started at the same time and
+#                 they share one rate limit and daily budget, see WorkQueue.py
+mode = 'run'
+
+#the keys used to find the duplicates, leads connected through any of them are merged as one group, see
+#BlockingIndex.py and ClusterLeads.py. 'name_company' and 'name_website' can be added to also match leads by name,
+#use the plan mode to review the groups they produce before merging them
+blocking = ['email', 'plus_address', 'sfdcLeadId', 'mcUserId__c']
+
+#groups with more leads than this are not merged but logged as oversized for review
+max_group_size = 10
+
+#set chunk_size to a number of rows to stream input_file in chunks instead of reading it all into memory, groups are
+#then merged as soon as they are complete. For streaming input_file must be sorted by email (case insensitive) and
+#only exact email duplicates are found
+chunk_size = None
+
+#Read in the lead information from a CSV and group the duplicate leads by the blocking keys e.g. their normalized
+#email address. The CSV does not need to be sorted, each group is a dictionary of field -> list of lead values
+#(field_dict) which is resolved into its winning values by planGroup, see ResolveGroup.py and the rules in Priority.py
+if mode == 'worker':
+    queue = WorkQueue(queue_file)
+    plans = queue.claim()
+    total = queue.remaining()
+    oversized = []
+elif mode == 'execute_plan':
+    plans = readPlan(plan_file)
+    total = pq.ParquetFile(plan_file).metadata.num_rows
+    oversized = []
+elif chunk_size:
+    groups = streamGroups(input_file, fields, chunk_size)
+    plans = (planGroup(field_dict) for field_dict in groups)
+    total = None
+    oversized = []
+else:
+    raw_list = pd.read_csv(input_file)
+    groups, oversized = clusterLeads(raw_list, fields, blocking, max_size=max_group_size)
+    plans = (planGroup(field_dict) for field_dict in groups)
+    total = len(groups)
+
+print(len(oversized), 'groups with more than', max_group_size, 'leads will not be merged')
+
+if mode == 'plan':
+    print(writePlan(plans, plan_file), 'groups planned in', plan_file)
+    sys.exit()
+
+if mode == 'enqueue':
+    print(WorkQueue(queue_file).enqueue(plans), 'groups added to', queue_file)
+    sys.exit()
+
+#the journal records the state of every group next to the input file. If a previous run over the same file died
+#part way through then the groups it completed are skipped and the merged groups only get their update sent.
+#Every merge and update call goes through one shared limiter so that Marketo's limits of 100 calls per 20 secs and
+#10 concurrent calls are respected across all of the threads, see RateLimiter.py. The workers keep the state of
+#their groups in the work queue instead and share the limits with the other workers through it
+if mode == 'worker':
+    journal = queue
+    journal.recover()
+    limiter = SharedRateLimiter(queue_file)
+else:
+    journal = MergeJournal(input_file + '.journal.jsonl')
+    limiter = RateLimiter()
+
+#check that what is left of today's API quota (see quota_ledger.py) covers the merges and updates still to do before
+#making any calls, a run that cannot even start raises QuotaExceeded. If only some of the groups fit then only those
+#are merged and the journal leaves the rest for a run after the quota resets. Streamed groups are not known up front
+#and the workers are held to the daily budget of the work queue instead, so neither is checked here.
+#The groups are estimated in a first pass over the plan file's columns or the grouped leads (see MergeQuota.py),
+#so the plans are still streamed and only the first `fits` groups left to merge are let through
+def isPending(key):
+    return key not in journal.done and key not in journal.pending_updates
+
+def pendingEstimates(keyed_estimates):
+    global pending
+    yield estimatePendingUpdates(journal.pending_updates)
+    for key, estimate in keyed_estimates:
+        if isPending(key):
+            pending += 1
+            yield estimate
+
+if mode in ('run', 'execute_plan') and not chunk_size:
+    pending = 0
+    if mode == 'execute_plan':
+        keyed_estimates = estimatePlanFile(plan_file)
+    else:
+        keyed_estimates = ((groupKey(field_dict), estimateLeads(field_dict)) for field_dict in groups)
+    fits = preflight(pendingEstimates(keyed_estimates)) - 1
+    if fits < pending:
+        print('only', fits, 'of the', pending, 'groups left to merge fit in today\'s API quota, run again once it',
+              'resets to merge the rest')
+        plans = islice((plan for plan in plans if isPending(plan['group'])), fits)
+
+#the groups do not share any leads so they are merged concurrently, one thread per concurrent call that Marketo
+#allows. max_in_flight caps how many groups are submitted ahead of the ones being logged
+executor = ThreadPoolExecutor(max_workers=limiter.concurrency)
+max_in_flight = 2 * limiter.concurrency
+
+#the surviving id of CRM merged groups is looked up for many groups at once (see SurvivorResolver.py) and the
+#winning values of merged groups are sent to createUpdateLead in batches of up to 300 records.
+#Groups that were merged by a previous run but not updated yet have their survivor looked up again
+resolver = SurvivorResolver(base_url, limiter=limiter)
+batcher = UpdateBatcher(base_url, limiter=limiter)
+lead_values = {}
+for key, (record, losers) in journal.pending_updates.items():
+    resolver.add(key, record, [record['id']] + losers)
+
+#create a log file, each merge and update is written as one JSON line by a background writer (see log_sink.py).
+#The API metrics are written next to it every 15 secs as _metrics.json and _metrics.prom (see api_metrics.py)
 dateTimeObj = datetime.now()
 file_name = dateTimeObj.strftime("%m-%d-%Y_%H:%M:%S")
 file_name = "/home/tyron/Downloads/" + file_name + " " + os.path.basename(__file__)
-file_name = file_name.replace("py","txt")
-
-remaining = 0
-limit = len(raw_list)
-
-while i < limit:
-
-    #if the remaining token life is less than 60 secs then break out of the inner while loop and
-    # wait for the token to expire before getting a new one
-    time.sleep(remaining)
-
-    count = 0
-    start = time.time()
-    temp = getToken()
-    token = temp[0]
-    expires = temp[1]
-    print(token, expires)
-    remaining = expires - (time.time() - start)
-
-    # Give a 60 sec window so token does not expire mid execution of the loop below
-    while i < limit and remaining> 60 :
-
-        field_dict = field_dict.fromkeys(field_dict, [])
-        final_dict = final_dict.fromkeys(final_dict, [])
-
-        #while the email address in subsequent rows is the same populate field_dict with the leads' field values
-        appendDict(field_dict, raw_list[i])
-        j=i+1
-        while j < len(raw_list) and (raw_list[i]['email'] == raw_list[j]['email']):
-            appendDict(field_dict, raw_list[j])
-            j=j+1
-
-        i = j
-
-        #convert id to an int
-        for n in range(0, len(field_dict['id'])):
-            field_dict['id'][n] = int(field_dict['id'][n])
-
-        #for each field in field_dict compare the input lead values to determine the winning value that will be on the
-        #resultant merged lead
-        for line in field_dict:
-            #if all lead values match then assign the value of the first lead to final dict for this field
-            if all(elem==field_dict[line][0] for elem in field_dict[line]) and line != 'sfdcLeadId':
-                final_dict[line] =field_dict[line][0]
-            else:
-                if line in ['email', 'id', 'Lead_Source_Detail__c', 'utm_source__c', 'utm_medium__c' ,'utm_campaign__c', 'mcUserId__c' ]:
-                    pass
-                #set the sfdcLeadId, id, and mcUserId__c in final_dict to the values from the first lead with a
-                # non-null SFDC ID
-                elif line == 'sfdcLeadId':
-                    [index, value] = ruler(line, field_dict[line])
-                    if value is not None:
-                        final_dict[line] = value
-                        final_dict['id'] = field_dict['id'][index]
-                        final_dict['mcUserId__c'] = field_dict['mcUserId__c'][index]
-                    #set the createdAt, id, and mcUserId__c in final_dict to the values from the lead that was
-                    # created first
-                    else:
-                        [index, value] = ruler("createdAt", field_dict["createdAt"])
-                        final_dict["createdAt"] = value
-                        final_dict['id'] = field_dict['id'][index]
-                        final_dict['mcUserId__c'] = field_dict['mcUserId__c'][index]
-                #set the leadSource, Lead_Source_Detail, and 3xutm fields to the values from the lead with the
-                #highest priority leadSource
-                elif line == 'leadSource':
-                    [index, value]=ruler(line, field_dict[line])
-                    final_dict[line] = value
-                    final_dict["Lead_Source_Detail__c"] = field_dict["Lead_Source_Detail__c"][index]
-                    if field_dict["utm_source__c"][index]: #not empty
-                        final_dict["utm_source__c"] = field_dict["utm_source__c"][index]
-                        final_dict["utm_medium__c"] = field_dict["utm_medium__c"][index]
-                        final_dict["utm_campaign__c"] = field_dict["utm_campaign__c"][index]
-                    #if neither lead has leadSource populated then get the 3xutm parameters from the first lead with
-                    #non-null utm_source__c
-                    else:
-                        [index, value] = ruler("utm_source__c", field_dict["utm_source__c"])
-
-                        final_dict["utm_campaign__c"] = field_dict["utm_campaign__c"][index]
-                        final_dict["utm_medium__c"] = field_dict["utm_medium__c"][index]
-                        final_dict["utm_campaign__c"] = field_dict["utm_campaign__c"][index]
-                #pass the field and lead values for this field to the ruler function in the priority script to
-                #obtain the winning field value according to the rules specified in the functions inside the
-                #priority script
-                else:
-                    final_dict[line] = ruler(line, field_dict[line])[1]
-
-        #log the the values from each lead for all of the fields of interest i.e. field_dict
-        f = open(file_name, "a")
-        dateTimeObj = datetime.now()
-        f.write(dateTimeObj.strftime("%m-%d-%Y_%H:%M:%S") + "\t" + str(count) + "\t" + str(i) + "\n\n")
-        f.write("Winning and losing lead information:\n")
-        f.write(str(field_dict) + "\n\n")
-        f.write("Winning ID with field and value combinations to be updated after merging:\n")
-
-        print(count)
-        print(i)
-        print(field_dict)
-        print(final_dict)
-        print('')
-
-        #store the losing lead id(s)
-        loser_ids = field_dict['id']
-        loser_ids.remove(final_dict['id'])
-
-        #convert leadScore from float to int to prevent merge failure and store the result in update_leads
-        update_leads[0] = final_dict
-        if isinstance(update_leads[0]['leadScore'], numbers.Number):
-            update_leads[0]['leadScore'] = int(update_leads[0]['leadScore'])
-
-        #log the winning field values that the resultant merged lead with be updated with
-        f.write(str(update_leads[0]) + "\n\n")
-
-        #merge the leads and log the response returned
-        response = mergeLead(base_url, token, final_dict['id'], loser_ids, True)
-        f.write("Merge Response:\n")
-        f.write(str(response)+"\n\n")
-        print(response)
-
-        #if the merged failed then close the log file
-        if '"success":false' in str(response):
-            f.write("---------------------------------------------------------------------------------------\n\n")
-            f.close()
-        #else update the merged lead with the winning field values from update_leads and log the response
+file_name = file_name.replace(".py", ".jsonl")
+log = JsonLogSink(file_name)
+get_metrics().start(file_name.replace(".jsonl", "_metrics"))
+
+#counts of the updates that were sent or left out because the survivor already had the winning values, and of the
+#fields sent or left out of the updates, printed and logged at the end of the run
+stats = {'updates_sent': 0, 'updates_unchanged': 0, 'fields_sent': 0, 'fields_unchanged': 0}
+for field_dict in oversized:
+    log.write('oversized', leads=field_dict)
+
+#runs on the worker threads: merge the losing leads of a planned group into the winner. Only a merge that certainly
+#failed is final, one that may still have been applied (see mergeOutcome) is journaled as a survivor to look up
+def mergeGroup(count, plan, token):
+    key = plan['group']
+    journal.record(key, 'planned', winner=plan['winner_id'], losers=plan['loser_ids'], final=plan['final'])
+    response = mergeLead(base_url, token, plan['winner_id'], plan['loser_ids'], plan['crm_merge'], limiter)
+
+    outcome = mergeOutcome(response)
+    if outcome == 'failed':
+        journal.record(key, 'failed', response=response)
+    elif outcome == 'unknown':
+        journal.record(key, 'survivor', survivor=None, response=response)
+    else:
+        journal.record(key, 'merged')
+
+    return count, plan, response, outcome
+
+#runs on the main thread once a group's merge has finished: log the lead values, the winning values and the merge
+#response, then queue the winning values to update the merged lead
+def handleMerge(count, plan, response, outcome):
+    key = plan['group']
+
+    #log the values from each lead for all of the fields of interest i.e. field_dict (when the group was not read
+    #from a plan), the winning values that the merged lead will be updated with and the merge response(s)
+    log.write('merge', count=count, total=total, group=key, leads=plan['leads'], final=plan['final'],
+              response=[parse_response(x) for x in response])
+    print(count, key, response)
+
+    #if the merge failed then the group is done. A merge that was not done in the CRM always keeps the planned
+    #winner so its winning field values are queued for the update straight away, a CRM merge or a merge whose
+    #outcome is unknown first has its survivor looked up
+    if outcome != 'failed':
+        if plan['crm_merge'] or outcome == 'unknown':
+            lead_values[key] = plan['leads']
+            if resolver.add(key, plan['final'], [plan['winner_id']] + list(plan['loser_ids'])):
+                handleSurvivors(resolver.resolve(token))
+        else:
+            queueUpdate(key, plan['final'], plan['leads'])
+
+#queue only the winning values that differ from the survivor's values in the input file (see UpdateDiff.py) and
+#update the merged leads in one call once 300 of them are waiting. If nothing differs the group is already complete
+def queueUpdate(key, record, field_dict=None):
+    changed = changedFields(record, field_dict)
+    if changed is None:
+        stats['updates_unchanged'] += 1
+        stats['fields_unchanged'] += len(record) - 1
+        log.write('update', group=key, id=record['id'], result={'status': 'unchanged'})
+        journal.record(key, 'resolved', survivor=record['id'])
+        return
+
+    stats['updates_sent'] += 1
+    stats['fields_sent'] += len(changed) - 1
+    stats['fields_unchanged'] += len(record) - len(changed)
+    if batcher.add(key, changed):
+        handleUpdates(batcher.flush(token))
+
+#point the winning values of each looked up group at its survivor and queue the update. If the lookup call failed
+#then the group stays "merged" in the journal so the lookup and update are done on the next run. If more than one of
+#the group's leads still exists the merge was not applied and the group has failed
+def handleSurvivors(results):
+    for key, record, survivor, status in results:
+        log.write('survivor', group=key, planned_id=record['id'], survivor=survivor, status=status)
+        field_dict = lead_values.pop(key, None)
+        if status == 'found':
+            record['id'] = survivor
+            journal.record(key, 'survivor', survivor=survivor)
+            queueUpdate(key, record, field_dict)
+        elif status == 'missing':
+            journal.record(key, 'resolved', survivor=None)
+        elif status == 'unmerged':
+            journal.record(key, 'failed', response='more than one of the leads still exists after the merge')
+
+#log the update result of each record in a flushed batch. A record skipped because its lead no longer exists (1004)
+#completes the group. If the update call itself failed, or the record was skipped for any other reason (e.g. an
+#invalid value), then the group stays "merged" in the journal with the reasons so its update is sent on the next run
+def handleUpdates(results):
+    for key, record, result in results:
+        print(key, result)
+        log.write('update', group=key, id=record['id'], result=result)
+        status = result.get('status')
+        reasons = result.get('reasons', result.get('errors', []))
+        if status == 'updated':
+            journal.record(key, 'resolved', survivor=record['id'])
+        elif status == 'skipped' and any(str(reason.get('code')) == '1004' for reason in reasons):
+            journal.record(key, 'resolved', survivor=None)
         else:
-            response = createUpdateLead(base_url, token, update_leads)
-            print(response)
-            f.write("Update Response:\n")
-            f.write(response + "\n\n")
-            n = 0
-            #Even if the conditional logic above determines the lead id to come from Person A, if Person B is a contact
-            #and Person A is a lead in Salesforce then Marketo's merge method will ensure that Person B is the winner.
-            #Hence, after a successful merge if the update response contains skipped then cycle through the rest of
-            #the "losing" ids to find the actual winner i.e. the id of the one lead that still exists
-            while '"status":"skipped"' in str(response) and n < len(loser_ids):
-                update_leads[0]['id'] = loser_ids[n]
-                print(update_leads[0])
-                f.write(str(update_leads[0]) + "\n\n")
-                response = createUpdateLead(base_url, token, update_leads)
-                print(response)
-                f.write("Update Response:\n")
-                f.write(response + "\n\n")
-                n=n+1
-
-            f.write("---------------------------------------------------------------------------------------\n\n")
-            f.close()
-
-        count = count + 1
-
-        #sleep for 0.2secs to ensure that Marketo's REST API limit of 100 calls per 20 secs is not exceeded
-        time.sleep(0.2)
-
-        #recalculate the remaining token lifespan before moving to the next merge
-        remaining = expires - (time.time() - start)
-        #sometimes the time elapsed can be greater than the original lifespan of the token, hence the reason for
-        #setting remaining to zero below to prevent the time.sleep method from failing
-        if remaining < 0:
-            remaining = 0
+            journal.record(key, 'updated', id=record['id'], status=status, reasons=reasons, next_id=record['id'],
+                           candidates=[])
+
+#wait for at least one of the submitted groups to finish merging and handle the finished ones
+def collect(in_flight):
+    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in done:
+        handleMerge(*future.result())
+    return in_flight
+
+#get a valid access token from the shared token provider (see Marketo_API_Get_Auth.py). The token is refreshed in the
+#background as soon as it expires and is shared with any other workers, so this only waits for the very first token
+def refreshToken():
+    global token
+    token = getToken()
+
+token = None
+in_flight = set()
+
+for count, plan in enumerate(plans):
+    if plan['group'] in journal.done or plan['group'] in journal.pending_updates:
+        continue
+    refreshToken()
+    in_flight.add(executor.submit(mergeGroup, count, plan, token))
+    if len(in_flight) >= max_in_flight:
+        in_flight = collect(in_flight)
+
+while in_flight:
+    in_flight = collect(in_flight)
+
+executor.shutdown()
+
+#look up the survivors still waiting in the resolver and send the records still waiting in the batcher
+while len(resolver) > 0:
+    refreshToken()
+    handleSurvivors(resolver.resolve(token))
+
+while len(batcher) > 0:
+    refreshToken()
+    handleUpdates(batcher.flush(token))
+
+print(stats['updates_sent'], 'updates sent and', stats['updates_unchanged'], 'left out as unchanged,',
+      stats['fields_sent'], 'fields sent and', stats['fields_unchanged'], 'left out as unchanged')
+log.write('stats', **stats)
+
+#the calls made per endpoint with their latency, bytes, retries and rate limit hits (see api_metrics.py)
+print(get_metrics().summary())
+log.write('metrics', **get_metrics().snapshot())
+
+journal.close()
+log.close()
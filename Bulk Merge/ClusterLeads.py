@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from BlockingIndex import blockCodes
+from GroupLeads import sliceGroups
+
+#label every row with the earliest row of its connected component, so the groups come out in file order.
+#This is union/find done on whole arrays instead of one row at a time: every round each edge hooks the root of its
+#later end under the root of its earlier end (np.minimum.at keeps the smallest when several edges hook the same
+#root) and then every row jumps to its root by repeated parent[parent] lookups. A parent is always an earlier row,
+#so no cycles can form, and the number of rounds only grows with the length of the longest chain of keys
+def componentRoots(n, a, b):
+    parent = np.arange(n)
+    while True:
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+        ra = parent[a]
+        rb = parent[b]
+        differ = ra != rb
+        if not differ.any():
+            return parent
+        a, b = a[differ], b[differ]
+        np.minimum.at(parent, np.maximum(ra[differ], rb[differ]), np.minimum(ra[differ], rb[differ]))
+
+#cluster the leads that are connected through any of the keys into one group e.g. when lead A shares an email with
+#B and B shares an sfdcLeadId with C then A, B and C are one group. Each key is factorized once (see BlockingIndex.py)
+#and every row is joined to the first row with the same key value, the joins are then resolved into groups with
+#array operations in componentRoots.
+#Clusters with more than max_size leads usually come from a junk value shared by many leads, they are returned
+#separately as oversized so they can be reviewed instead of merged. Returns (groups, oversized) in the same shape
+#as GroupLeads.groupLeads
+def clusterLeads(df, fields, keys=('email', 'sfdcLeadId', 'mcUserId__c'), min_size=2, max_size=None):
+
+    n = len(df)
+    edges_a = []
+    edges_b = []
+
+    for key in keys:
+        codes = blockCodes(df, key)
+        rows = np.flatnonzero(codes >= 0)
+        if len(rows) == 0:
+            continue
+
+        #the first row of each key value, found with one unique over the codes in row order
+        uniques, first = np.unique(codes[rows], return_index=True)
+        linked = rows[first][np.searchsorted(uniques, codes[rows])]
+
+        edges_a.append(rows[rows != linked])
+        edges_b.append(linked[rows != linked])
+
+    if edges_a:
+        roots = componentRoots(n, np.concatenate(edges_a), np.concatenate(edges_b))
+    else:
+        roots = np.arange(n)
+    group_codes, uniques = pd.factorize(roots)
+
+    oversized_codes = np.full(n, -1, dtype=np.int64)
+    if max_size:
+        sizes = np.bincount(group_codes)
+        too_big = sizes[group_codes] > max_size
+        oversized_codes[too_big] = group_codes[too_big]
+        group_codes[too_big] = -1
+
+    return sliceGroups(df, fields, group_codes, min_size), sliceGroups(df, fields, oversized_codes, min_size)
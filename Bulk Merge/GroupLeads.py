@@ -0,0 +1,120 @@
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+#normalize the email column into the grouping key so that duplicates that only differ by case or by surrounding
+#whitespace end up in the same group. Empty emails are turned into NA so they are never grouped together
+def emailKey(emails):
+    key = emails.astype('string').str.strip().str.lower()
+    return key.mask(key == '')
+
+#take the raw lead export (in any row order) and return every duplicate group in the same shape as the field_dict
+#used by BulkMerge.py i.e. {field: [value of lead 1, value of lead 2, ...]}
+#rows with an empty email are dropped and groups smaller than min_size (i.e. leads with no duplicates) are skipped
+def groupLeads(df, fields, key='email', min_size=2):
+    codes, uniques = pd.factorize(emailKey(df[key]))
+    return sliceGroups(df, fields, codes, min_size)
+
+#return the groups of rows that share the same integer group code (-1 means the row is not in any group)
+#the grouping is done in one columnar pass instead of a Python loop per row:
+# 1. the keys are factorized into integer codes by the caller (codes are handed out in order of first appearance)
+# 2. one stable sort of the codes brings the rows of each group together while keeping their original file order
+# 3. the group boundaries are the positions where the sorted code changes
+def sliceGroups(df, fields, codes, min_size=2):
+
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+
+    #rows without a group are marked with -1, which the sort moves to the front
+    keep = sorted_codes >= 0
+    order = order[keep]
+    sorted_codes = sorted_codes[keep]
+
+    if len(sorted_codes) == 0:
+        return []
+
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(sorted_codes)]
+    duplicated = (ends - starts) >= min_size
+    starts = starts[duplicated]
+    ends = ends[duplicated]
+
+    if len(starts) == 0:
+        return []
+
+    #keep only the rows of the groups that are returned, packed together so the groups stay contiguous
+    lengths = ends - starts
+    packed_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    order = order[np.repeat(starts - packed_starts, lengths) + np.arange(lengths.sum())]
+    starts = packed_starts
+    ends = packed_starts + lengths
+
+    #reorder each column once so every group is a contiguous slice, converting NaN to None as the rules expect.
+    #Only the kept rows are converted, and each column is turned into a Python list once so the groups can be sliced
+    #out of the lists when they are used
+    columns = {}
+    for field in fields:
+        columns[field] = df[field].take(order).to_numpy(dtype=object, na_value=None).tolist()
+
+    return Groups(fields, columns, starts.tolist(), ends.tolist())
+
+#the duplicate groups found by sliceGroups. Building a dict of lists for hundreds of thousands of groups up front
+#costs more than finding them, so each group's field_dict is only sliced out of the reordered columns when it is
+#read. It behaves like the list of groups it replaces: it has a length, can be indexed and iterated any number of times
+class Groups(Sequence):
+
+    def __init__(self, fields, columns, starts, ends):
+        self.fields = fields
+        self.columns = columns
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        s, e = self.starts[i], self.ends[i]
+        return {field: self.columns[field][s:e] for field in self.fields}
+
+    def __iter__(self):
+        columns = [self.columns[field] for field in self.fields]
+        for s, e in zip(self.starts, self.ends):
+            yield {field: column[s:e] for field, column in zip(self.fields, columns)}
+
+#read the lead export in chunks of chunk_size rows and yield each duplicate group as soon as its key closes, so the
+#memory used is bounded by the chunk size and the largest group instead of the size of the file.
+#A key can only be known to be closed when the next key starts, so for streaming the export must be sorted by email
+#(case insensitive, ignoring surrounding whitespace). The order is checked as the file is read and a ValueError is
+#raised at the first key that is out of order
+def streamGroups(path, fields, chunk_size=100000, key='email', min_size=2):
+
+    carry = None
+
+    for chunk in pd.read_csv(path, chunksize=chunk_size, usecols=fields):
+        keys = emailKey(chunk[key])
+        chunk = chunk[keys.notna()]
+
+        #the rows of the last key of the previous chunk are still open, so they are read again with this chunk
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        if len(chunk) == 0:
+            continue
+
+        keys = emailKey(chunk[key]).to_numpy(dtype=object)
+        out_of_order = np.flatnonzero(keys[1:] < keys[:-1])
+        if len(out_of_order):
+            raise ValueError(path + ' is not sorted by email: "' + str(keys[out_of_order[0] + 1]) + '" comes after "'
+                             + str(keys[out_of_order[0]]) + '", sort the export or read it without streaming')
+
+        open_rows = keys == keys[-1]
+        carry = chunk[open_rows]
+        for group in groupLeads(chunk[~open_rows], fields, key, min_size):
+            yield group
+
+    if carry is not None:
+        for group in groupLeads(carry, fields, key, min_size):
+            yield group
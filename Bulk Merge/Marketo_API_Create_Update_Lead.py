@@ -1,10 +1,20 @@
-import requests
 import json
+from contextlib import nullcontext
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+from retry_policy import NON_IDEMPOTENT_POLICY
 
 #use the Marketo REST API leads endpoint to update a lead field's with the values contained
 #within the input lead_dict
 #https://developers.marketo.com/rest-api/lead-database/leads/#create_and_update
-def createUpdateLead(base_url, token, lead_dict):
+#when called alongside concurrent merges a shared RateLimiter is passed in, http_session holds it around each
+#attempt. Like a merge the update is not retried after a 604/608 as it may have been applied
+def createUpdateLead(base_url, token, lead_dict, limiter=nullcontext()):
 
     url = base_url + '/rest/v1/leads.json'
 
@@ -18,6 +28,7 @@ def createUpdateLead(base_url, token, lead_dict):
         'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+    response = http_session.request("POST", url, retry=NON_IDEMPOTENT_POLICY, limiter=limiter, headers=headers,
+                                    data=json.dumps(payload))
 
     return (response.text)
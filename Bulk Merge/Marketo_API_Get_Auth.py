@@ -1,15 +1,16 @@
-import requests
-import json
+import os
+import sys
 
-#use the Marketo REST API token endpoint to obtain an access token and the
-#lifespan of the token in seconds
-#https://developers.marketo.com/rest-api/authentication/#creating_an_access_token
-def getToken ():
-    response = requests.get('https://###-xxx-###.mktorest.com/identity/oauth/token?grant_type=client_credentials&client_id=########-####-####-####-############&client_secret=#######################')
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
 
-    dictionary = json.loads(response.text)
+from token_provider import TokenProvider
 
-    token = dictionary['access_token']
-    expires = dictionary['expires_in']
+#one access token shared by all of the threads, and through a locked file cache by all of the processes, using the
+#same API user. The next token is fetched in the background as soon as the current one expires, see token_provider.py
+#https://developers.marketo.com/rest-api/authentication/#creating_an_access_token
+tokens = TokenProvider('https://###-xxx-###.mktorest.com', '########-####-####-####-############', '#######################')
 
-    return [token, expires]
+#return a valid access token, this only waits for the identity endpoint the first time it is called
+def getToken ():
+    return tokens.get()
@@ -0,0 +1,28 @@
+from contextlib import nullcontext
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+
+#use the Marketo REST API leads endpoint to get the leads with the given ids (up to 300 per call), only the fields
+#listed in fields are returned for each lead. Ids that do not exist (e.g. losers of a merge) are left out of the result
+#https://developers.marketo.com/rest-api/lead-database/leads/#query
+def getLeadsById(base_url, token, ids, fields=('id',), limiter=nullcontext()):
+
+    url = base_url + '/rest/v1/leads.json'
+
+    params = {
+        'filterType': 'id',
+        'filterValues': ','.join(str(x) for x in ids),
+        'fields': ','.join(fields)
+    }
+    headers = {
+        'Authorization': 'Bearer ' + token
+    }
+
+    response = http_session.request("GET", url, limiter=limiter, headers=headers, params=params)
+
+    return (response.text)
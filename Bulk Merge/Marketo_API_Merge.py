@@ -1,21 +1,74 @@
+from contextlib import nullcontext
+import json
+import os
+import sys
+
 import requests
 
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+from retry_policy import NON_IDEMPOTENT_POLICY
+
+#the number of losing ids that can be sent in a single merge call when mergeInCRM is false
+max_losers_per_call = 3
+
+#error codes after which Marketo may or may not have applied a merge: 604/608 (the call timed out on Marketo's side),
+#1004 (a lead was not found, e.g. because an earlier attempt already merged it away) and 'unknown', which mergeLead
+#reports when the call raised (a read timeout, a 5xx or a connection dropped mid request)
+unknown_outcome_codes = ('604', '608', '1004', 'unknown')
+
 #this function merges multiple leads together using the merge REST API endpoint
 #https://developers.marketo.com/rest-api/lead-database/leads/#merge
-def mergeLead(base_url, token, winner_id, loser_ids, CRMmerge):
+#when the merges are run concurrently a shared RateLimiter is passed in, http_session holds it around each attempt.
+#A merge that timed out on Marketo's side (604/608) may have been applied, so it is not retried. A call that raised is
+#reported as an 'unknown' error and the remaining losers are not sent, see mergeOutcome
+def mergeLead(base_url, token, winner_id, loser_ids, CRMmerge, limiter=nullcontext()):
 
+    url = base_url + '/rest/v1/leads/' + str(winner_id) + '/merge.json'
     payload = {}
     headers = {
         'Content-Type': 'application/json',
         'Authorization': 'Bearer ' + token
     }
 
-    #When mergeinCRM is TRUE then you can only merge two leads at a time (when this is false you can merge multiple
-    #leads in a single call) hence why a for loop is needed to successively merge each of the losing ids with the winner
+    #When mergeinCRM is TRUE then you can only merge two leads at a time hence why a loop is needed to successively
+    #merge each of the losing ids with the winner. When it is FALSE multiple losing ids are sent in a single call
     loser_ids = [str(x) for x in loser_ids]
+    step = 1 if CRMmerge else max_losers_per_call
     response = []
-    for i in loser_ids:
-        url = base_url + '/rest/v1/leads/' + str(winner_id) + '/merge.json?mergeInCRM=' + str(CRMmerge) + '&leadIds=' + i
-        response.append(requests.request("POST", url, headers=headers, data=payload).text)
+    for i in range(0, len(loser_ids), step):
+        params = {'mergeInCRM': str(CRMmerge), 'leadIds': ','.join(loser_ids[i:i + step])}
+        try:
+            response.append(http_session.request("POST", url, retry=NON_IDEMPOTENT_POLICY, limiter=limiter,
+                                                 headers=headers, params=params, data=payload).text)
+        except requests.exceptions.RequestException as e:
+            message = type(e).__name__ + ': ' + str(e)
+            response.append(json.dumps({'success': False, 'errors': [{'code': 'unknown', 'message': message}]}))
+            break
 
     return (response)
+
+#return 'merged' when every merge call succeeded, 'unknown' when a call failed in a way that it may still have been
+#applied (the leads have to be looked up to find out) and 'failed' when a call certainly failed e.g. a bad lead id
+def mergeOutcome(response):
+    outcome = 'merged'
+    for text in response:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return 'unknown'
+        if data.get('success'):
+            continue
+        codes = [str(error.get('code')) for error in data.get('errors', [])]
+        if any(code in unknown_outcome_codes for code in codes):
+            return 'unknown'
+        outcome = 'failed'
+    return outcome
+
+#the merge only needs to be done in the CRM when at least one of the losing leads is synced to Salesforce, otherwise
+#all of the losers can be merged into the winner in Marketo with a single call
+def needsCRMmerge(field_dict, loser_ids):
+    return any(sfdc_id is not None for lead_id, sfdc_id in zip(field_dict['id'], field_dict['sfdcLeadId'])
+               if lead_id in loser_ids)
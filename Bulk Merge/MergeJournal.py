@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+
+#a group is identified by the sorted ids of its leads, which stays the same between runs over the same export
+#no matter in which order the groups are processed
+def groupKey(field_dict):
+    return '-'.join(sorted(str(int(x)) for x in field_dict['id']))
+
+#durable append-only record of the state of every merge group so that a run that dies part way through (token error,
+#network blip, Ctrl-C) can be restarted without re-issuing merges against leads that no longer exist.
+#Each line is a JSON object {"group": key, "state": state, ...} and is flushed and fsynced before the call that
+#depends on it is made. The states of a group move through:
+# planned  - the winner, losers and final values were decided and the merge is about to be sent
+# merged   - the merge succeeded, the winning values still need to be written to the survivor
+# failed   - the merge failed (or the lookup after an unknown outcome found it was not applied), nothing else will be
+#            done for the group
+# survivor - the id of the lead that survived a CRM merge was looked up, or with survivor null the merge call failed
+#            in a way that it may still have been applied and its survivor has to be looked up to find out
+# updated  - an update call failed or skipped the record for a reason other than 1004, with the reasons (older
+#            journals also list skipped candidate ids)
+# resolved - the survivor was updated (or no survivor exists), the group is complete
+#on start up the existing journal is replayed: complete groups are skipped, merged groups only have their survivor
+#looked up and their update queued again and groups that were only planned are run again from the start
+class MergeJournal:
+
+    done_states = ('failed', 'resolved')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        self.pending_updates = {}
+        self.replay()
+        self.file = open(path, 'a')
+
+        #start on a fresh line if the previous run was cut off mid entry
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    #rebuild the state of each group from the entries written by previous runs
+    def replay(self):
+        if not os.path.exists(self.path):
+            return
+
+        planned = {}
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    #the last line can be cut short if the process died while writing it
+                    continue
+
+                key = entry['group']
+                state = entry['state']
+                if state == 'planned':
+                    planned[key] = entry
+                    self.pending_updates.pop(key, None)
+                elif state == 'merged' and key in planned:
+                    record = dict(planned[key]['final'])
+                    self.pending_updates[key] = (record, list(planned[key]['losers']))
+                elif state == 'survivor' and entry['survivor'] is None and key in planned:
+                    record = dict(planned[key]['final'])
+                    self.pending_updates[key] = (record, list(planned[key]['losers']))
+                elif state == 'survivor' and key in self.pending_updates:
+                    record, candidates = self.pending_updates[key]
+                    record['id'] = entry['survivor']
+                elif state == 'updated' and key in self.pending_updates:
+                    record, candidates = self.pending_updates[key]
+                    record['id'] = entry['next_id']
+                    self.pending_updates[key] = (record, list(entry['candidates']))
+                elif state in self.done_states:
+                    self.done.add(key)
+                    self.pending_updates.pop(key, None)
+
+    #append an entry and make sure it is on disk before returning
+    def record(self, key, state, **values):
+        entry = dict(group=key, state=state, **values)
+        line = json.dumps(entry, default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,77 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from MergeJournal import groupKey
+from ResolveGroup import resolveGroup
+from Marketo_API_Merge import needsCRMmerge
+
+#the merge plan stores one row per group: the group key (see MergeJournal.py), the winning id, the losing ids,
+#whether the merge has to be done in the CRM and the final field values the merged lead will be updated with.
+#The final values are stored as a JSON string because their types differ from field to field,
+#e.g. pd.read_parquet(plan_file) can be used to review a plan and two plans can be diffed by joining them on group
+plan_schema = pa.schema([
+    ('group', pa.string()),
+    ('winner_id', pa.int64()),
+    ('loser_ids', pa.list_(pa.int64())),
+    ('crm_merge', pa.bool_()),
+    ('final', pa.string()),
+])
+
+#number of groups written to / read from the Parquet file at a time
+rows_per_batch = 10000
+
+#resolve every group without making any API calls and return the planned merge
+def planGroup(field_dict):
+    final_dict = resolveGroup(field_dict)
+    loser_ids = [x for x in field_dict['id'] if x != final_dict['id']]
+    return {
+        'group': groupKey(field_dict),
+        'winner_id': final_dict['id'],
+        'loser_ids': loser_ids,
+        'crm_merge': needsCRMmerge(field_dict, loser_ids),
+        'final': final_dict,
+        'leads': field_dict,
+    }
+
+#write the planned merges to a Parquet file in batches so the whole plan never has to be held in memory
+def writePlan(plans, path):
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, plan_schema) as writer:
+        for plan in plans:
+            batch.append({
+                'group': plan['group'],
+                'winner_id': plan['winner_id'],
+                'loser_ids': plan['loser_ids'],
+                'crm_merge': plan['crm_merge'],
+                'final': json.dumps(plan['final'], default=str),
+            })
+            if len(batch) >= rows_per_batch:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=plan_schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=plan_schema))
+            count += len(batch)
+
+    return count
+
+#open a plan file written by writePlan, a file without all of the columns of plan_schema was not written by this
+#version of the planner and is refused rather than guessing the missing values
+def openPlan(path):
+    plan_file = pq.ParquetFile(path)
+    missing = [name for name in plan_schema.names if name not in plan_file.schema_arrow.names]
+    if missing:
+        raise ValueError(path + ' is missing the plan columns ' + ', '.join(missing) + ', write the plan again')
+    return plan_file
+
+#stream the planned merges back from a Parquet file in the same format as planGroup (without the lead values)
+def readPlan(path):
+    plan_file = openPlan(path)
+    for batch in plan_file.iter_batches(batch_size=rows_per_batch):
+        for row in batch.to_pylist():
+            row['final'] = json.loads(row['final'])
+            row['leads'] = None
+            yield row
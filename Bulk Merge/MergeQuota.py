@@ -0,0 +1,44 @@
+import math
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+from quota_ledger import Estimate
+
+from Marketo_API_Merge import max_losers_per_call
+from MergePlan import openPlan, rows_per_batch
+from SurvivorResolver import max_ids_per_call
+from UpdateBatcher import max_batch_size
+
+#estimate the REST calls a run will spend so that it can be checked against what is left of Marketo's daily quota
+#before it starts (see quota_ledger.py). A CRM merge takes one call per loser and a Marketo only merge one call per
+#3 losers. The survivor lookups and the updates are batched, so each group only spends its share of a call on them.
+#The estimate is an upper bound, updates that turn out to be unchanged are never sent (see UpdateDiff.py)
+def estimateMerge(losers, crm_merge):
+    if crm_merge:
+        calls = losers + (losers + 1) / max_ids_per_call
+    else:
+        calls = math.ceil(losers / max_losers_per_call)
+    return Estimate(calls=calls + 1 / max_batch_size)
+
+#estimate a group of leads (field_dict) without resolving its winner, so that the groups can be checked before any
+#of them is planned. It counts as a CRM merge when any of its leads is synced to Salesforce, an upper bound of
+#needsCRMmerge which leaves out the winner
+def estimateLeads(field_dict):
+    return estimateMerge(len(field_dict['id']) - 1, any(x is not None for x in field_dict['sfdcLeadId']))
+
+#stream the (group key, estimate) of every group of a plan written by MergePlan.py, reading only the columns needed
+#and not the final values
+def estimatePlanFile(path):
+    plan_file = openPlan(path)
+    for batch in plan_file.iter_batches(batch_size=rows_per_batch, columns=['group', 'loser_ids', 'crm_merge']):
+        data = batch.to_pydict()
+        for key, loser_ids, crm_merge in zip(data['group'], data['loser_ids'], data['crm_merge']):
+            yield key, estimateMerge(len(loser_ids), crm_merge)
+
+#the groups merged by a previous run that still need their survivor looked up and their update sent
+def estimatePendingUpdates(pending_updates):
+    ids = sum(1 + len(losers) for record, losers in pending_updates.values())
+    return Estimate(calls=ids / max_ids_per_call + len(pending_updates) / max_batch_size)
@@ -1,104 +1,154 @@
-from datetime import datetime
+import json
+import os
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+#the prioritization rules are declared in priority_rules.json and compiled once when this module is imported:
+# - null_like: the "null-like" substrings that make a value count as empty for notNull
+# - priority: the prioritized values for certain lead fields in order of decreasing priority from left to right
+# - rules: the name of the prioritization function that is used for each field
+#mcUserId__c, Lead_Source_Detail__c and the 3xutm fields (apart from utm_source__c) have no rule because their
+#values are pulled from the same lead as sfdcLeadId, leadSource and utm_source__c respectively
+rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'priority_rules.json')
+
+#how many distinct values per field are remembered by the compiled priority and null-like lookups
+cache_size = 100000
+
+#timestamps in this exact format sort chronologically as plain strings so they never need to be parsed
+created_at_format = '%Y-%m-%dT%H:%M:%SZ'
+created_at_pattern = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z')
+
+#compile the null-like substrings into one case insensitive regex and return a cached lookup of whether a value
+#is non-null and does not contain any null-like values
+def compileNullLike(null_like):
+    pattern = re.compile('|'.join(re.escape(x) for x in null_like), re.IGNORECASE)
+
+    @lru_cache(maxsize=cache_size)
+    def isGood(value):
+        return not pattern.search(value)
+
+    def good(value):
+        return value is not None and isGood(str(value))
+
+    return good
+
+#compile the prioritized values of a field into a cached lookup that returns the rank of a value i.e. the position
+#of the first prioritized value it contains, or None when it does not contain any of them
+def compileRanks(prioritized):
+
+    @lru_cache(maxsize=cache_size)
+    def rank(value):
+        for n, j in enumerate(prioritized):
+            if j in value:
+                return n
+        return None
+
+    def lookup(value):
+        return rank(value) if isinstance(value, str) else None
+
+    return lookup
+
+#return the sort key for a createdAt value, only values that are not in the standard format are parsed. Parsed values
+#are converted to UTC (values without an offset are taken to be UTC already) so that they compare with the others
+def createdAtKey(value):
+    if created_at_pattern.fullmatch(value):
+        return value
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime(created_at_format)
 
 #return the index and value (in string format) containing the earliest created at date
 def createdAt(list, *args):
+    best = None
+    for n, value in enumerate(list):
+        if value is None:
+            continue
+        key = createdAtKey(value)
+        if best is None or key < best[1]:
+            best = [n, key]
 
-    time_list= [datetime.strptime(i, '%Y-%m-%dT%H:%M:%SZ') for i in list]
-    return [time_list.index(min(time_list)), min(time_list).strftime('%Y-%m-%dT%H:%M:%SZ') ]
+    return best if best is not None else [0, None]
 
 #return the index and value of the maximum lead score unless the score is highly negative, then return this
-#negative value (for bad quality leads)
+#negative value (for bad quality leads). Empty scores are ignored without modifying the input list
 def leadScore(list, *args):
+    best = None
+    for n, value in enumerate(list):
+        if value is None or value == 'None':
+            continue
+        if value < -10:
+            return [n, value]
+        if best is None or value > best[1]:
+            best = [n, value]
 
-    new_list = list
+    return best if best is not None else [0, None]
 
-    while 'None' in new_list:
-        del new_list[new_list.index('None')]
+#return the first index and value where the value is non-null and does not contain "null-like" values
+def notNull(list, *args):
+    for n, value in enumerate(list):
+        if good(value):
+            return [n, value]
 
-    for i in new_list:
-        if i < -10:
-            return [list.index(i), i]
+    return [0, list[0]]
 
+#use the compiled ranks to find the highest priority value and corresponding index among the input lead values
+#for a certain field in a single pass. Else if none of the input lead values has a prioritized value return the
+#first non-null value and index
+def priority(list, line):
+    rank = ranks[line]
+    best = None
+    for n, value in enumerate(list):
+        r = rank(value)
+        if r is not None and (best is None or r < best[0]):
+            best = [r, n, value]
+            if r == 0:
+                break
+
+    if best is not None:
+        return best[1:]
 
-    return [list.index(max(new_list)), max(new_list) ]
+    return(notNull(list))
 
-#return the first index and value where the value is non-null and does not contain "null-like" values
-def notNull(list,*args):
+#return the first TRUE value and its index. True is prioritized because this function is used for the unsubscribed
+#account blocked fields where it is important to favor TRUE over FALSE. If there is no TRUE value then return the
+#first non-empty value
+def boolTest(list, *args):
+    for n, value in enumerate(list):
+        if value is True:
+            return [n, value]
 
-    new_list=[x.lower() for x in list]
+    for n, value in enumerate(list):
+        if value is not None:
+            return [n, value]
 
-    crap = ["empty", "unknown", "n/a", "[", "]", 'none']
+    return [0, None]
 
-    for i in new_list:
-        good = "true"
-        for j in crap:
-            if j in i:
-                good = False
-        if good:
-                return [new_list.index(i), list[new_list.index(i)]]
+functions = {
+    'createdAt': createdAt,
+    'leadScore': leadScore,
+    'notNull': notNull,
+    'priority': priority,
+    'boolTest': boolTest,
+}
 
-    return [0, list[0]]
+#load the rules from the config file and compile them into the lookups used by the functions above
+def loadRules(path=rules_file):
+    global null_like, good, ranks, priority_dict, rules
 
-#define the prioritized values for certain lead fields in order of descreasing priority from left to right
-priority_dict = {
-            'website': [".com", ".net", ".org"],
-            'country': ["United States", "USA"],
-            'leadSource': ["Advertising", "Paid Search", "Organic", "Marketing Generated", "Event",  "Tradeshow",  "Content", "Webinar", "Referral", "Sales Generated","Direct"],
-            'leadStatus': ['Disqualified','Customer','Closed Won','SQL','SDR Engaged','SAL','MQL','ReNurture','SSL','Prospects','Prospects Cold','Known','Not a Lead'],
-            'Lead_Status__c': ['Disqualified','Closed Won','SQL','SDR Engaged','SAL','MQL','ReNurture','reNurture','SSL','Prospects','Prospects Cold','Known', 'Not a Lead'],
-            'Lifecycle_Stage_Person__c': ['Disqualified','Closed Won','SQL','SAL','MQL','reNurture','SSL','Prospects','Prospects Cold', 'Known','Not a Lead'],
-        }
-
-#use the priority_dict function to find the highest priority value and corresponding index among the input
-#lead values for a certain field. Else if none of the input lead values has a prioritized value return the first
-#non-null value and index
-def priority(list, line):
-    for j in priority_dict[line]:
-        for i in list:
-            if j in i:
-                return [list.index(i), i]
+    with open(path) as f:
+        config = json.load(f)
 
-    return(notNull(list))
+    null_like = config['null_like']
+    good = compileNullLike(null_like)
+    priority_dict = config['priority']
+    ranks = {line: compileRanks(tuple(prioritized)) for line, prioritized in priority_dict.items()}
+    rules = {line: functions[name] for line, name in config['rules'].items()}
 
-#return the first TRUE value and its index. True is prioritized because this function is used for the unsubscribed
-#account blocked fields where it is important to favor TRUE over FALSE
-def boolTest(list, *args):
-    for i in list:
-        if i is True:
-            return [list.index(i), i]
-
-#define the prioritization function that will be called for each field
-rules = {
-            'createdAt': createdAt,
-            'sfdcLeadId': notNull,
-            'firstName': notNull,
-            'lastName': notNull,
-            'company': notNull,
-            'title': notNull,
-            'website': priority,
-            'country': priority,
-            #'mcUserId__c': [],
-            'Querystring__c': notNull,
-            'leadSource': priority,
-            #'Lead_Source_Detail__c': [], will pull from the same lead as lead source
-            'utm_source__c': notNull,
-            #'utm_medium__c': [], will pull from the same lead as utm_source
-            #'utm_campaign__c': [], will pull from the same lead as utm_source
-            'leadScore': leadScore,
-            'leadStatus': priority,
-            'Lead_Status__c': priority,
-            'Lifecycle_Stage_Person__c': priority,
-            'unsubscribed':boolTest,
-            'MC_Account_Blocked__c': boolTest,
-        }
-
-#create a new list with None converted to string format and then pass this list to the rules dictionary so
-#the correct prioritzation function is used on the lead
+loadRules()
+
+#pass the lead values for a field to the prioritization function configured for that field, which returns the
+#index and value of the winning lead value
 def ruler (line, line_list):
-    formatted_list = []
-    for x in line_list:
-        if x is None:
-            formatted_list.append('None')
-        else:
-            formatted_list.append(x)
-    return rules[line](formatted_list, line)
+    return rules[line](line_list, line)
@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+from quota_ledger import quota_day
+
+from WorkQueue import threadConnection
+
+#Marketo's REST API allows 100 calls per 20 secs and at most 10 calls in flight at the same time, going over
+#either limit returns error 606 (rate limit) or 615 (concurrent access limit)
+#https://developers.marketo.com/rest-api/marketo-integration-best-practices/
+#
+#this limiter is shared by all of the threads making calls. It is a token bucket with room for `calls` tokens where
+#each spent token only comes back `period` secs after the call's response arrived, so no sliding 20 sec window can
+#ever contain more than 100 calls (a bucket that refills continuously would allow a burst of 100 on top of the refill).
+#The calls reach Marketo with some skew, so the window is counted from the response time and `margin` secs are added
+#to it, otherwise Marketo sometimes counts 101 calls in one window and answers 606.
+#The concurrency cap is a semaphore that is held for the duration of each call, a thread that has to wait for room
+#in the window gives its slot back while it waits
+class RateLimiter:
+
+    def __init__(self, calls=100, period=20, concurrency=10, margin=1):
+        self.calls = calls
+        self.period = period + margin
+        self.concurrency = concurrency
+        self.spent = deque()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    #block until a call is allowed by both the window and the concurrency cap. The calls still in flight count
+    #towards the window until their response arrives
+    def acquire(self):
+        while True:
+            self.slots.acquire()
+            with self.lock:
+                now = time.monotonic()
+                while self.spent and now - self.spent[0] >= self.period:
+                    self.spent.popleft()
+                if len(self.spent) + self.in_flight < self.calls:
+                    self.in_flight += 1
+                    return
+                wait = self.period - (now - self.spent[0]) if self.spent else 0.05
+            self.slots.release()
+            time.sleep(wait)
+
+    #the call's response arrived, its token comes back `period` secs from now
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.spent.append(time.monotonic())
+        self.slots.release()
+
+    #used as "with limiter:" around each individual HTTP call
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+#the same limits shared by several BulkMerge.py worker processes through the SQLite file of the work queue (see
+#WorkQueue.py). Every call is a row in the calls table, so the 20 sec window, the concurrent calls and the calls made
+#today are counted across all of the workers. The check and the insert are done in one write transaction, which
+#SQLite only lets one process hold at a time. Like RateLimiter the window is counted from the response time of each
+#call plus `margin` secs. A call that is never released (the worker died mid call) stops counting towards the window
+#and the concurrency cap after stale_secs. The daily budget is counted per Marketo quota day, which resets at midnight
+#US Central time and not UTC (see quota_ledger.py)
+class SharedRateLimiter:
+
+    def __init__(self, path, calls=100, period=20, concurrency=10, daily_calls=50000, stale_secs=120, margin=1):
+        self.path = path
+        self.calls = calls
+        self.period = period + margin
+        self.concurrency = concurrency
+        self.daily_calls = daily_calls
+        self.stale_secs = stale_secs
+        self.local = threading.local()
+
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS calls (id INTEGER PRIMARY KEY, started REAL, finished REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS daily_calls (day TEXT PRIMARY KEY, calls INTEGER)')
+
+    def connection(self):
+        if not hasattr(self.local, 'ids'):
+            self.local.ids = []
+        return threadConnection(self.local, self.path)
+
+    #block until a call is allowed by the window, the concurrency cap and the daily budget
+    def acquire(self):
+        while True:
+            with self.connection() as db:
+                now = time.time()
+                day = quota_day()
+                db.execute('DELETE FROM calls WHERE finished < ? OR (finished IS NULL AND started < ?)',
+                           (now - self.period, now - self.stale_secs))
+                finished, oldest = db.execute('SELECT COUNT(*), MIN(finished) FROM calls WHERE finished IS NOT NULL'
+                                              ).fetchone()
+                in_flight = db.execute('SELECT COUNT(*) FROM calls WHERE finished IS NULL').fetchone()[0]
+                window = finished + in_flight
+                row = db.execute('SELECT calls FROM daily_calls WHERE day = ?', (day,)).fetchone()
+                today = row[0] if row else 0
+
+                if today >= self.daily_calls:
+                    raise RuntimeError('the daily budget of ' + str(self.daily_calls) + ' calls has been spent')
+
+                if window < self.calls and in_flight < self.concurrency:
+                    call_id = db.execute('INSERT INTO calls (started) VALUES (?)', (now,)).lastrowid
+                    db.execute('INSERT INTO daily_calls VALUES (?, 1) '
+                               'ON CONFLICT(day) DO UPDATE SET calls = calls + 1', (day,))
+                    self.local.ids.append(call_id)
+                    return
+
+                wait = self.period - (now - oldest) if window >= self.calls and oldest else 0.1
+            time.sleep(max(wait, 0.01))
+
+    def release(self):
+        with self.connection() as db:
+            db.execute('UPDATE calls SET finished = ? WHERE id = ?', (time.time(), self.local.ids.pop()))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,70 @@
+import numbers
+
+from Priority import ruler
+
+#fields that are never decided on their own, their values are pulled from the same lead as a related field
+linked_fields = ['email', 'id', 'Lead_Source_Detail__c', 'utm_source__c', 'utm_medium__c', 'utm_campaign__c', 'mcUserId__c']
+
+#for each field in field_dict compare the input lead values to determine the winning value that will be on the
+#resultant merged lead and return these winning values as final_dict
+def resolveGroup(field_dict):
+
+    #convert id to an int
+    field_dict['id'] = [int(x) for x in field_dict['id']]
+
+    final_dict = {}
+
+    for line in field_dict:
+        #if all lead values match then assign the value of the first lead to final dict for this field
+        if all(elem == field_dict[line][0] for elem in field_dict[line]) and line != 'sfdcLeadId':
+            final_dict[line] = field_dict[line][0]
+        elif line in linked_fields:
+            pass
+        #set the sfdcLeadId, id, and mcUserId__c in final_dict to the values from the first lead with a
+        # non-null SFDC ID
+        elif line == 'sfdcLeadId':
+            [index, value] = ruler(line, field_dict[line])
+            if value is not None:
+                final_dict[line] = value
+                final_dict['id'] = field_dict['id'][index]
+                final_dict['mcUserId__c'] = field_dict['mcUserId__c'][index]
+            #set the createdAt, id, and mcUserId__c in final_dict to the values from the lead that was
+            # created first
+            else:
+                [index, value] = ruler("createdAt", field_dict["createdAt"])
+                final_dict["createdAt"] = value
+                final_dict['id'] = field_dict['id'][index]
+                final_dict['mcUserId__c'] = field_dict['mcUserId__c'][index]
+        #set the leadSource, Lead_Source_Detail, and 3xutm fields to the values from the lead with the
+        #highest priority leadSource
+        elif line == 'leadSource':
+            [index, value] = ruler(line, field_dict[line])
+            final_dict[line] = value
+            final_dict["Lead_Source_Detail__c"] = field_dict["Lead_Source_Detail__c"][index]
+            if field_dict["utm_source__c"][index]: #not empty
+                final_dict["utm_source__c"] = field_dict["utm_source__c"][index]
+                final_dict["utm_medium__c"] = field_dict["utm_medium__c"][index]
+                final_dict["utm_campaign__c"] = field_dict["utm_campaign__c"][index]
+            #if neither lead has leadSource populated then get the 3xutm parameters from the first lead with
+            #non-null utm_source__c
+            else:
+                [index, value] = ruler("utm_source__c", field_dict["utm_source__c"])
+                final_dict["utm_source__c"] = field_dict["utm_source__c"][index]
+                final_dict["utm_medium__c"] = field_dict["utm_medium__c"][index]
+                final_dict["utm_campaign__c"] = field_dict["utm_campaign__c"][index]
+        #pass the field and lead values for this field to the ruler function in the priority script to
+        #obtain the winning field value according to the rules specified in the functions inside the
+        #priority script
+        else:
+            final_dict[line] = ruler(line, field_dict[line])[1]
+
+    #any linked field that was not decided above (e.g. emails that only differ by case) takes the value of the
+    #winning lead, and the output keeps the same field order as field_dict
+    winner = field_dict['id'].index(final_dict['id'])
+    final_dict = {line: final_dict[line] if line in final_dict else field_dict[line][winner] for line in field_dict}
+
+    #convert leadScore from float to int to prevent merge failure
+    if isinstance(final_dict['leadScore'], numbers.Number):
+        final_dict['leadScore'] = int(final_dict['leadScore'])
+
+    return final_dict
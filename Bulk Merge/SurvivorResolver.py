@@ -0,0 +1,74 @@
+import json
+from contextlib import nullcontext
+
+from Marketo_API_Get_Leads import getLeadsById
+
+#Marketo accepts at most 300 filter values in a single lead query
+max_ids_per_call = 300
+
+#Even if the conditional logic determines the lead id to come from Person A, if Person B is a contact and Person A is
+#a lead in Salesforce then Marketo's merge method will ensure that Person B is the winner. So after a CRM merge the
+#surviving id is looked up instead of being guessed: the ids of many recently merged groups are collected and queried
+#in a single call, and the one id of each group that still exists is its survivor.
+#The lookup also settles merges whose outcome was unknown (see mergeOutcome in Marketo_API_Merge.py): when more than
+#one of a group's ids still exists the merge was not applied.
+#resolve returns a (key, record, survivor, status) tuple per group where status is
+# found    - survivor is the id of the lead that still exists (the planned winner when it still exists)
+# missing  - none of the group's ids exist anymore, survivor is None
+# unmerged - more than one of the group's ids still exists, survivor is None
+# failed   - the lookup call failed, survivor is None and the group should be tried again
+class SurvivorResolver:
+
+    def __init__(self, base_url, limiter=nullcontext()):
+        self.base_url = base_url
+        self.limiter = limiter
+        self.pending = []
+        self.id_count = 0
+
+    #queue a merged group with all of its ids (winner and losers) and return True once a full lookup is waiting
+    def add(self, key, record, ids):
+        self.pending.append((key, record, list(ids)))
+        self.id_count += len(ids)
+        return self.id_count >= max_ids_per_call
+
+    def __len__(self):
+        return len(self.pending)
+
+    #look up the ids of the oldest queued groups (at most 300 ids, but always at least one group) in one call
+    def resolve(self, token):
+        if not self.pending:
+            return []
+
+        batch = []
+        ids = []
+        while self.pending and (not batch or len(ids) + len(self.pending[0][2]) <= max_ids_per_call):
+            group = self.pending.pop(0)
+            batch.append(group)
+            ids.extend(group[2])
+        self.id_count -= len(ids)
+
+        response = getLeadsById(self.base_url, token, ids, limiter=self.limiter)
+
+        try:
+            data = json.loads(response)
+        except ValueError:
+            data = {'success': False}
+
+        if not data.get('success'):
+            return [(key, record, None, 'failed') for key, record, group_ids in batch]
+
+        existing = set(int(lead['id']) for lead in data.get('result', []))
+
+        results = []
+        for key, record, group_ids in batch:
+            alive = [x for x in group_ids if int(x) in existing]
+            if len(alive) > 1:
+                results.append((key, record, None, 'unmerged'))
+            elif record['id'] in alive:
+                results.append((key, record, record['id'], 'found'))
+            elif alive:
+                results.append((key, record, alive[0], 'found'))
+            else:
+                results.append((key, record, None, 'missing'))
+
+        return results
@@ -0,0 +1,58 @@
+import json
+from contextlib import nullcontext
+
+import requests
+
+from Marketo_API_Create_Update_Lead import createUpdateLead
+
+#Marketo accepts at most 300 records in the input array of a single create/update call
+#https://developers.marketo.com/rest-api/lead-database/leads/#create_and_update
+max_batch_size = 300
+
+#collects the winning records of successfully merged groups so that they can be sent to createUpdateLead in
+#batches of up to 300 instead of one call per group. Each record is added with a key (e.g. the group number) and
+#flush returns a (key, record, result) triple per record, where result is the matching entry from the "result"
+#array of the response e.g. {"id": 123, "status": "updated"} or {"status": "skipped", "reasons": [...]}
+class UpdateBatcher:
+
+    def __init__(self, base_url, batch_size=max_batch_size, limiter=nullcontext()):
+        self.base_url = base_url
+        self.limiter = limiter
+        self.batch_size = min(batch_size, max_batch_size)
+        self.pending = []
+
+    #queue a record and return True once a full batch is waiting to be flushed
+    def add(self, key, record):
+        self.pending.append((key, record))
+        return len(self.pending) >= self.batch_size
+
+    def __len__(self):
+        return len(self.pending)
+
+    #send the oldest batch of queued records in one call and map the per record results back to their keys
+    def flush(self, token):
+        if not self.pending:
+            return []
+
+        batch = self.pending[:self.batch_size]
+        self.pending = self.pending[self.batch_size:]
+
+        #the update is not sent again after a 5xx or a dropped connection (see http_session.py), the records are
+        #marked as failed instead and sent again on the next run, which is safe as the values are the same
+        try:
+            response = createUpdateLead(self.base_url, token, [record for key, record in batch], self.limiter)
+        except requests.exceptions.RequestException as e:
+            response = type(e).__name__ + ': ' + str(e)
+
+        try:
+            data = json.loads(response)
+        except ValueError:
+            data = {'success': False, 'errors': [{'message': response}]}
+
+        #Marketo returns one result per input record in the same order as the input array, when the whole call
+        #fails there is no result array so every record in the batch is marked as failed
+        results = data.get('result') if data.get('success') else None
+        if not results or len(results) != len(batch):
+            results = [{'status': 'failed', 'errors': data.get('errors', [])}] * len(batch)
+
+        return [(key, record, result) for (key, record), result in zip(batch, results)]
@@ -0,0 +1,39 @@
+import math
+
+#compare the winning values of a merged group with the values the surviving lead had in the input file so that the
+#update only sends the fields that actually change. When all of the duplicates agree the survivor often already
+#holds every winning value and the update can be left out altogether.
+#A merge keeps the values of the winning lead, so a field that already matched before the merge still matches after
+#it. If the lead values are not known (e.g. a group read from a plan or recovered from the journal) or the survivor is
+#not one of the group's leads then the whole record is sent as before
+
+#NaN (an empty cell in pandas) and None are both an empty value, and 10 and 10.0 are the same value
+def isEmpty(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def sameValue(a, b):
+    if isEmpty(a) or isEmpty(b):
+        return isEmpty(a) and isEmpty(b)
+    return a == b
+
+#return the record to send for the survivor: the id plus the fields whose value differs from the survivor's current
+#value, or None when nothing changes
+def changedFields(final_dict, field_dict):
+    if field_dict is None:
+        return final_dict
+
+    ids = [int(x) for x in field_dict['id']]
+    if int(final_dict['id']) not in ids:
+        return final_dict
+    row = ids.index(int(final_dict['id']))
+
+    changed = {'id': final_dict['id']}
+    for line, value in final_dict.items():
+        if line == 'id':
+            continue
+        if line not in field_dict or not sameValue(value, field_dict[line][row]):
+            changed[line] = value
+
+    if len(changed) == 1:
+        return None
+    return changed
@@ -0,0 +1,121 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+#open (once per thread, sqlite connections cannot be shared between threads) a connection to the SQLite file at
+#path and return it wrapped in a write transaction
+def threadConnection(local, path):
+    if not hasattr(local, 'db'):
+        local.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        local.db.execute('PRAGMA journal_mode=WAL')
+    return Transaction(local.db)
+
+#BEGIN IMMEDIATE takes the write lock up front, so two processes can never both read a row (a queued group or a call
+#count) and then both act on it
+class Transaction:
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+#durable work queue of planned merge groups in a SQLite file so that several BulkMerge.py worker processes can
+#drain one big backlog together. The groups are added once with mode = 'enqueue' and every process started with
+#mode = 'worker' then claims them claim_size at a time. Workers on other hosts need the file on a shared filesystem
+#with working file locks.
+#The queue also takes the place of MergeJournal.py for the workers: record() stores the same states (planned, merged,
+#failed, survivor, updated, resolved) on the group's row and refreshes the lease of the worker holding it. A group
+#whose worker stopped refreshing it for lease_secs is claimed again by another worker: from the start if it was not
+#merged yet, or only for its survivor lookup and update if it was.
+#The same file holds the call counts of SharedRateLimiter (see RateLimiter.py) so the workers never go over Marketo's
+#limits together, the access token is shared through the file cache of token_provider.py
+class WorkQueue:
+
+    done_states = ('failed', 'resolved')
+    update_states = ('merged', 'survivor', 'updated')
+
+    def __init__(self, path, lease_secs=900, claim_size=50):
+        self.path = path
+        self.lease_secs = lease_secs
+        self.claim_size = claim_size
+        self.worker = socket.gethostname() + ':' + str(os.getpid())
+        self.local = threading.local()
+        self.done = set()
+        self.pending_updates = {}
+
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS groups (grp TEXT PRIMARY KEY, plan TEXT, state TEXT, '
+                       'record_id INTEGER, worker TEXT, heartbeat REAL, detail TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS groups_state ON groups (state, heartbeat)')
+
+    def connection(self):
+        return threadConnection(self.local, self.path)
+
+    #add planned groups to the queue, groups that are already in it are left as they are
+    def enqueue(self, plans):
+        count = 0
+        with self.connection() as db:
+            for plan in plans:
+                cursor = db.execute('INSERT OR IGNORE INTO groups (grp, plan, state, record_id) VALUES (?, ?, ?, ?)',
+                                    (plan['group'], json.dumps(plan, default=str), 'queued', plan['winner_id']))
+                count += cursor.rowcount
+        return count
+
+    #number of groups in the queue that are not complete
+    def remaining(self):
+        with self.connection() as db:
+            return db.execute('SELECT COUNT(*) FROM groups WHERE state NOT IN (?, ?)', self.done_states).fetchone()[0]
+
+    #take over the merged groups whose worker stopped before updating them, their survivor lookup and update are
+    #queued again in pending_updates like the groups recovered by MergeJournal.replay
+    def recover(self):
+        now = time.time()
+        with self.connection() as db:
+            rows = db.execute('SELECT grp, plan, record_id FROM groups WHERE state IN (?, ?, ?) AND heartbeat < ?',
+                              self.update_states + (now - self.lease_secs,)).fetchall()
+            for key, plan, record_id in rows:
+                db.execute('UPDATE groups SET worker = ?, heartbeat = ? WHERE grp = ?', (self.worker, now, key))
+                plan = json.loads(plan)
+                record = dict(plan['final'], id=record_id)
+                self.pending_updates[key] = (record, plan['loser_ids'])
+        return self.pending_updates
+
+    #yield the queued groups (and the ones whose worker stopped before merging them) claim_size at a time until the
+    #queue is empty
+    def claim(self):
+        while True:
+            now = time.time()
+            with self.connection() as db:
+                rows = db.execute('SELECT grp, plan FROM groups WHERE state = ? OR (state IN (?, ?) AND heartbeat < ?) '
+                                  'ORDER BY rowid LIMIT ?',
+                                  ('queued', 'claimed', 'planned', now - self.lease_secs, self.claim_size)).fetchall()
+                for key, plan in rows:
+                    db.execute('UPDATE groups SET state = ?, worker = ?, heartbeat = ? WHERE grp = ?',
+                               ('claimed', self.worker, now, key))
+            if not rows:
+                return
+            for key, plan in rows:
+                yield json.loads(plan)
+
+    #store the new state of a group, the id the winning values will be written to and any other values for review
+    def record(self, key, state, **values):
+        record_id = values.get('winner', values.get('survivor', values.get('next_id')))
+        detail = json.dumps(values, default=str)
+        with self.connection() as db:
+            db.execute('UPDATE groups SET state = ?, record_id = COALESCE(?, record_id), worker = ?, heartbeat = ?, '
+                       'detail = ? WHERE grp = ?', (state, record_id, self.worker, time.time(), detail, key))
+        if state in self.done_states:
+            self.done.add(key)
+
+    def close(self):
+        if hasattr(self.local, 'db'):
+            self.local.db.close()
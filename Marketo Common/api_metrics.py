@@ -0,0 +1,220 @@
+"""
+Latency and throughput metrics of the Marketo API calls made by a run
+
+Every attempt made through http_session (and the AsyncMarketoClient of Program
+Member Transition) is observed here under its method and endpoint, the path
+with its ids replaced by {id} as in quota_ledger.py:
+
+- a latency histogram with Prometheus style buckets
+- the number of calls and of calls that failed (HTTP >= 400, a Marketo error
+  code or no response at all)
+- the bytes sent and received
+- the retries made and the rate limit hits (606, 615 and HTTP 429)
+
+start() writes a snapshot every interval secs to <path>.json and, in the
+Prometheus textfile collector format, to <path>.prom. summary() returns a table
+of the endpoints ordered by the wall time spent waiting on them, for the end of
+a run. A p50 or p95 latency in the +Inf bucket is only known to be above the
+last bound, it is null in the JSON snapshot and ">60" in the summary.
+"""
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from quota_ledger import endpoint_name
+
+# Upper bounds in secs of the latency histogram buckets, the last bucket is +Inf
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_LIMIT_CODES = {'606', '615'}
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class EndpointStats:
+    """Counters of the calls to one method and endpoint"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def quantile(self, q: float) -> float:
+        """Latency below which a q share of the calls finished, interpolated within its bucket. math.inf when it
+        falls in the +Inf bucket, all that is known then is that it is above the last bound"""
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                if i == len(BUCKETS):
+                    return math.inf
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                return low + (BUCKETS[i] - low) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'calls': self.calls, 'errors': self.errors, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+            'retries': self.retries, 'rate_limited': self.rate_limited, 'latency_sum': round(self.latency_sum, 3),
+            'latency_p50': _rounded(self.quantile(0.5)), 'latency_p95': _rounded(self.quantile(0.95)),
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class ApiMetrics:
+    """Per endpoint metrics shared by every thread of the process"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.path = None
+        self.interval = None
+
+    def observe(self, method: str, url: str, latency: float, status: Optional[int] = None, bytes_in: int = 0,
+                bytes_out: int = 0, codes: Optional[List[str]] = None):
+        """Record one attempt, status None when it got no response"""
+        codes = codes or []
+        failed = status is None or status >= 400 or bool(codes)
+        bucket = next((i for i, bound in enumerate(BUCKETS) if latency <= bound), len(BUCKETS))
+        with self._lock:
+            stats = self._endpoint(method, url)
+            stats.calls += 1
+            stats.errors += failed
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.rate_limited += status == 429 or any(code in RATE_LIMIT_CODES for code in codes)
+            stats.latency_sum += latency
+            stats.buckets[bucket] += 1
+
+    def retry(self, method: str, url: str):
+        """Count an attempt that is about to be made again"""
+        with self._lock:
+            self._endpoint(method, url).retries += 1
+
+    def snapshot(self) -> Dict:
+        """{'started_at', 'written_at', 'endpoints': {'GET /rest/v1/...': {...}}}"""
+        with self._lock:
+            endpoints = {f"{method} {endpoint}": stats.as_dict() for (method, endpoint), stats in self._stats.items()}
+        return {'started_at': self.started_at, 'written_at': time.time(), 'endpoints': endpoints}
+
+    def prometheus(self) -> str:
+        """The snapshot in the Prometheus text exposition format"""
+        lines = [
+            '# TYPE marketo_api_request_duration_seconds histogram',
+            '# TYPE marketo_api_requests_total counter',
+            '# TYPE marketo_api_errors_total counter',
+            '# TYPE marketo_api_response_bytes_total counter',
+            '# TYPE marketo_api_request_bytes_total counter',
+            '# TYPE marketo_api_retries_total counter',
+            '# TYPE marketo_api_rate_limited_total counter',
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+            for (method, endpoint), stats in items:
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, count in zip([str(b) for b in BUCKETS] + ['+Inf'], stats.buckets):
+                    cumulative += count
+                    lines.append(f'marketo_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines += [
+                    f'marketo_api_request_duration_seconds_sum{{{labels}}} {stats.latency_sum:.6f}',
+                    f'marketo_api_request_duration_seconds_count{{{labels}}} {stats.calls}',
+                    f'marketo_api_requests_total{{{labels}}} {stats.calls}',
+                    f'marketo_api_errors_total{{{labels}}} {stats.errors}',
+                    f'marketo_api_response_bytes_total{{{labels}}} {stats.bytes_in}',
+                    f'marketo_api_request_bytes_total{{{labels}}} {stats.bytes_out}',
+                    f'marketo_api_retries_total{{{labels}}} {stats.retries}',
+                    f'marketo_api_rate_limited_total{{{labels}}} {stats.rate_limited}',
+                ]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Table of the endpoints, the one the run spent the most time waiting on first"""
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1].latency_sum, reverse=True)
+            total = sum(stats.latency_sum for key, stats in items) or 1.0
+            lines = [f"{'endpoint':<55} {'calls':>7} {'errors':>6} {'p50 s':>7} {'p95 s':>7} {'total s':>9} "
+                     f"{'share':>6} {'MB in':>8} {'retries':>7} {'limited':>7}"]
+            for (method, endpoint), stats in items:
+                lines.append(f"{(method + ' ' + endpoint)[:55]:<55} {stats.calls:>7} {stats.errors:>6} "
+                             f"{_format(stats.quantile(0.5)):>7} {_format(stats.quantile(0.95)):>7} "
+                             f"{stats.latency_sum:>9.1f} "
+                             f"{stats.latency_sum / total:>6.0%} {stats.bytes_in / 1024 / 1024:>8.1f} "
+                             f"{stats.retries:>7} {stats.rate_limited:>7}")
+        lines.append(f"wall time of the run: {time.time() - self.started_at:.1f} s")
+        return '\n'.join(lines)
+
+    def start(self, path: str, interval: float = 15):
+        """Write a snapshot to <path>.json and <path>.prom every interval secs and when the process exits"""
+        self.path = path
+        self.interval = interval
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ApiMetrics', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the periodic writer and write a last snapshot"""
+        self._stop.set()
+        if self.path:
+            self.write()
+
+    def write(self):
+        """Replace both snapshot files atomically, so a collector never reads half a file"""
+        _replace(self.path + '.json', json.dumps(self.snapshot(), indent=2))
+        _replace(self.path + '.prom', self.prometheus())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def _endpoint(self, method: str, url: str) -> EndpointStats:
+        key = (method.upper(), endpoint_name(urlparse(url).path))
+        if key not in self._stats:
+            self._stats[key] = EndpointStats()
+        return self._stats[key]
+
+
+def get_metrics() -> ApiMetrics:
+    """The metrics shared by every helper of the process"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = ApiMetrics()
+    return _metrics
+
+
+def _rounded(latency: float) -> Optional[float]:
+    """A quantile for the JSON snapshot, None when it is above the last bucket (JSON has no Infinity)"""
+    return None if math.isinf(latency) else round(latency, 3)
+
+
+def _format(latency: float) -> str:
+    """A quantile for the summary table"""
+    return f">{BUCKETS[-1]}" if math.isinf(latency) else f"{latency:.2f}"
+
+
+def _replace(path: str, text: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
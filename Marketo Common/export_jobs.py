@@ -0,0 +1,128 @@
+"""
+Create and enqueue bulk activity export jobs without leaving duplicates behind
+
+Every export job that runs counts against the 500 MB daily export quota, and
+Marketo only queues a few of them at a time (1029 when the queue is full), so
+a create or enqueue call that timed out on Marketo's side must not simply be
+sent again. Both go through http_session with NON_IDEMPOTENT_POLICY and:
+
+- every created job is recorded by its filter in a JSON file. Before a job is
+  created the recorded job for the same filter is reused if it is still
+  Created, Queued, Processing or Completed, e.g. when a script is run again
+  after it died part way through
+- when a create call may have been applied (604/608, a 5xx or a connection
+  dropped mid request) the jobs Created since the call was sent are listed and
+  the newest one is taken over before another is created
+- when an enqueue call may have been applied the job's status is checked and
+  it is only enqueued again while it is still Created
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import requests
+
+import http_session
+from retry_policy import NON_IDEMPOTENT_POLICY, error_codes
+
+# Codes after which Marketo may or may not have applied the call
+UNKNOWN_OUTCOME_CODES = {'604', '608'}
+# Statuses of a job that can still be enqueued or downloaded
+REUSABLE_STATUSES = ('Created', 'Queued', 'Processing', 'Completed')
+# Secs the clock of this machine may be ahead of Marketo's when looking for a job created by a call that failed
+CLOCK_SKEW = 60
+
+
+class ExportJobs:
+    """The export jobs of one Bulk API entity (activities, leads ...) of an instance, recorded in path"""
+
+    def __init__(self, base_url: str, path: str, entity: str = 'activities'):
+        self.url = f"{base_url}/bulk/v1/{entity}/export"
+        self.path = path
+        self.jobs = {}
+        self.reused = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+
+    def create(self, export_filter: Dict, token: str, fmt: str = 'CSV') -> str:
+        """Id of a job exporting export_filter, the recorded one if it can still be used or else a new one"""
+        key = json.dumps({'format': fmt, 'filter': export_filter}, sort_keys=True)
+        job_id = self.jobs.get(key)
+        if job_id and self.status(job_id, token) in REUSABLE_STATUSES:
+            self.reused.add(job_id)
+            return job_id
+
+        payload = json.dumps({'format': fmt, 'filter': export_filter})
+        sent = datetime.now(timezone.utc) - timedelta(seconds=CLOCK_SKEW)
+        data = self._post('/create.json', token, payload)
+        if data.get('success'):
+            job_id = data['result'][0]['exportId']
+        else:
+            job_id = self._created_since(sent, token) if data.get('unknown') else None
+            if job_id is None:
+                data = self._post('/create.json', token, payload)
+                if not data.get('success'):
+                    raise RuntimeError(f"creating the export job failed: {data}")
+                job_id = data['result'][0]['exportId']
+
+        self.jobs[key] = job_id
+        self._save()
+        return job_id
+
+    def enqueue(self, job_id: str, token: str):
+        """Queue a created job, checking whether a call that may have failed queued it after all. A reused job is
+        only queued while it is still Created"""
+        if job_id in self.reused and self.status(job_id, token) != 'Created':
+            return
+        data = self._post(f"/{job_id}/enqueue.json", token, '')
+        if data.get('unknown'):
+            if self.status(job_id, token) != 'Created':
+                return
+            data = self._post(f"/{job_id}/enqueue.json", token, '')
+        if not data.get('success'):
+            raise RuntimeError(f"enqueueing export job {job_id} failed: {data}")
+
+    def status(self, job_id: str, token: str) -> Optional[str]:
+        """Status of a job, None when Marketo no longer knows it (jobs are kept for 7 days)"""
+        response = http_session.request('GET', f"{self.url}/{job_id}/status.json", headers=_headers(token))
+        data = response.json()
+        return data['result'][0]['status'] if data.get('success') and data.get('result') else None
+
+    def _created_since(self, sent: datetime, token: str) -> Optional[str]:
+        """The newest job in status Created that was created at or after sent"""
+        response = http_session.request('GET', self.url + '.json', headers=_headers(token),
+                                        params={'status': 'Created'})
+        data = response.json()
+        jobs = [(_parse(job['createdAt']), job['exportId']) for job in data.get('result') or []]
+        jobs = [job for job in jobs if job[0] >= sent]
+        return max(jobs)[1] if jobs else None
+
+    def _post(self, path: str, token: str, payload: str) -> Dict:
+        """The decoded response of a POST, {'success': False, 'unknown': True, ...} when the call may have been
+        applied without its response arriving"""
+        try:
+            response = http_session.request('POST', self.url + path, retry=NON_IDEMPOTENT_POLICY,
+                                            headers=_headers(token), data=payload)
+        except requests.exceptions.RequestException as e:
+            return {'success': False, 'unknown': True, 'errors': [{'message': f"{type(e).__name__}: {e}"}]}
+        data = response.json()
+        if UNKNOWN_OUTCOME_CODES & set(error_codes(response.content)):
+            data['unknown'] = True
+        return data
+
+    def _save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _headers(token: str) -> Dict[str, str]:
+    return {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token}
+
+
+def _parse(text: str) -> datetime:
+    return datetime.fromisoformat(text.replace('Z', '+00:00'))
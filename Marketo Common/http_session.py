@@ -0,0 +1,201 @@
+"""
+Pooled keep-alive HTTP session shared by the Marketo scripts
+
+A bare requests.request() opens a new TCP connection and TLS handshake for
+every call. Every helper goes through the one MarketoSession returned by
+get_session() instead. It keeps up to pool_maxsize connections open per host,
+so the threads of a script reuse warm connections, and it asks for gzip
+encoded responses. Every call gets a (connect, read) timeout unless the caller
+passes its own.
+
+request(), get() and post() take the same arguments as their requests
+counterparts, so a helper only has to swap requests.request(...) for
+http_session.request(...). They also retry transient failures according to
+retry_policy.py, refreshing the access token of the TokenProvider registered
+for the host when Marketo rejects it. Pass retry=None to make a single attempt.
+A limiter (e.g. the RateLimiter of Bulk Merge) is held around each attempt
+only, so every retry waits for room under Marketo's limits and no slot is held
+while sleeping between attempts.
+Calls made with a policy that is not idempotent (NON_IDEMPOTENT_POLICY) are
+only sent again when the failed attempt never reached Marketo, i.e. the
+connection could not be opened or Marketo answered 429. A 5xx response raises
+HTTPError and a connection dropped mid request is raised as is, so that the
+caller can find out whether the call was applied.
+Every attempt that gets a response is recorded in the quota ledger, and every
+attempt and retry is timed and counted per endpoint, see quota_ledger.py and
+api_metrics.py.
+"""
+
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from typing import Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from api_metrics import get_metrics
+from quota_ledger import get_ledger
+from retry_policy import BACKOFF, DEFAULT_POLICY, REFRESH, RETRY, RetryPolicy, error_codes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (10, 120)  # secs to connect, secs to wait between bytes of the response
+POOL_CONNECTIONS = 4  # number of hosts (REST, identity, bulk file downloads ...) to keep a pool for
+POOL_MAXSIZE = 20  # open connections kept per host, at least the number of threads calling the same instance
+
+_session = None
+_lock = threading.Lock()
+_token_providers = {}
+_UNSET = object()
+
+
+class MarketoSession(requests.Session):
+    """requests.Session with sized connection pools, gzip negotiation and a default timeout"""
+
+    def __init__(self, timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.headers['Connection'] = 'keep-alive'
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> MarketoSession:
+    """Return the session shared by every thread of the process, creating it on first use"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = MarketoSession()
+    return _session
+
+
+def configure(timeout: Optional[Union[float, Tuple[float, float]]] = None, pool_connections: int = POOL_CONNECTIONS,
+              pool_maxsize: int = POOL_MAXSIZE) -> MarketoSession:
+    """Replace the shared session, e.g. with a bigger pool for a script that runs more threads"""
+    global _session
+    with _lock:
+        old = _session
+        _session = MarketoSession(timeout or DEFAULT_TIMEOUT, pool_connections, pool_maxsize)
+    if old is not None:
+        old.close()
+    return _session
+
+
+def register_token_provider(host: str, provider):
+    """Let request() swap in a new token from provider when Marketo rejects a token sent to host"""
+    _token_providers[host] = provider
+
+
+def request(method: str, url: str, retry: Optional[RetryPolicy] = _UNSET, limiter=None,
+            **kwargs) -> requests.Response:
+    """Make a call, retrying it according to retry (DEFAULT_POLICY unless given), and return the last response.
+    limiter is a context manager entered around every attempt"""
+    policy = DEFAULT_POLICY if retry is _UNSET else retry
+    limiter = limiter if limiter is not None else nullcontext()
+    session = get_session()
+    if policy is None:
+        with limiter:
+            return _attempt(session, method, url, kwargs)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with limiter:
+                response = _attempt(session, method, url, kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            #a POST that timed out while reading the response may have been applied, so it is not sent again, and
+            #neither is a non idempotent call whose request may have been sent before the connection dropped
+            read_timeout = isinstance(e, requests.exceptions.ReadTimeout)
+            if attempt >= policy.max_attempts or (read_timeout and method.upper() != 'GET') or \
+                    (not policy.idempotent and not _not_sent(e)):
+                raise
+            action, reason = RETRY, type(e).__name__
+        else:
+            if response.status_code >= 500 and not policy.idempotent:
+                response.raise_for_status()
+            if response.status_code == 429 or response.status_code >= 500:
+                action, reason = BACKOFF, f"HTTP {response.status_code}"
+            else:
+                codes = error_codes(response.content) if 'json' in response.headers.get('Content-Type', '') else []
+                action, reason = policy.classify(codes), ','.join(codes)
+            if action is None or attempt >= policy.attempts(action):
+                return response
+            if action == REFRESH and not _refresh_token(url, kwargs):
+                return response
+
+        wait = policy.delay(action, attempt)
+        get_metrics().retry(method, url)
+        logger.warning(f"{method} {urlparse(url).path} failed ({reason}), {action} attempt {attempt} in {wait:.1f}s")
+        time.sleep(wait)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def _attempt(session: MarketoSession, method: str, url: str, kwargs: dict) -> requests.Response:
+    """Make one call, timing it and counting it and the bytes it returned against today's quota. Streamed bodies
+    are counted by their Content-Length"""
+    started = time.monotonic()
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        get_metrics().observe(method, url, time.monotonic() - started)
+        raise
+    latency = time.monotonic() - started
+
+    if kwargs.get('stream'):
+        nbytes = int(response.headers.get('Content-Length') or 0)
+        codes = []
+    else:
+        nbytes = len(response.content)
+        codes = error_codes(response.content) if 'json' in response.headers.get('Content-Type', '') else []
+    body = response.request.body if response.request is not None else None
+    get_metrics().observe(method, url, latency, response.status_code, nbytes, len(body or b''), codes)
+    get_ledger().record(response.url or url, nbytes=nbytes)
+    return response
+
+
+def _not_sent(error: requests.exceptions.RequestException) -> bool:
+    """True when the call failed before any of the request was sent, i.e. the connection could not be opened"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def _refresh_token(url: str, kwargs: dict) -> bool:
+    """Replace the rejected token in the Authorization header or access_token param, False if it cannot be"""
+    provider = _token_providers.get(urlparse(url).netloc)
+    if provider is None:
+        return False
+
+    headers = dict(kwargs.get('headers') or {})
+    params = kwargs.get('params')
+    auth = headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        headers['Authorization'] = 'Bearer ' + provider.refresh(auth[len('Bearer '):])
+        kwargs['headers'] = headers
+        return True
+    if isinstance(params, dict) and 'access_token' in params:
+        kwargs['params'] = dict(params, access_token=provider.refresh(params['access_token']))
+        return True
+    return False
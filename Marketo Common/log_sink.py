@@ -0,0 +1,129 @@
+"""
+Buffered JSON Lines log sink shared by the Marketo scripts
+
+Log entries are serialized to compact JSON on the calling thread and handed to a
+background writer through a bounded queue. The writer appends them in batches,
+flushing at most every flush_interval seconds, and rotates the file once it
+grows past max_bytes (log.jsonl -> log.jsonl.1 -> log.jsonl.2 ...). The result
+can be queried afterwards with e.g. pandas.read_json(path, lines=True) or jq.
+
+A batch that cannot be written (e.g. the disk is full) is reported through
+logging and dropped, the writer carries on with the next one. Should the writer
+thread still die, write() raises instead of blocking on the full queue.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class JsonLogSink:
+    """Background writer of one JSON object per line"""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5,
+                 queue_size: int = 10000, batch_size: int = 500, flush_interval: float = 1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='JsonLogSink', daemon=True)
+        self._thread.start()
+
+    def write(self, event: str, **fields: Any):
+        """Queue one log entry, blocking only when the writer is queue_size entries behind"""
+        entry = {'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), 'event': event}
+        entry.update(fields)
+        line = json.dumps(entry, default=str, separators=(',', ':'))
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError(f"the log writer of {self.path} has stopped, the entry was not logged")
+            try:
+                self._queue.put(line, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Write everything still queued and close the file"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _run(self):
+        """Drain the queue in batches until close() is called"""
+        while True:
+            try:
+                line = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            lines = []
+            stop = False
+            while True:
+                if line is _STOP:
+                    stop = True
+                    break
+                lines.append(line)
+                if len(lines) >= self.batch_size:
+                    break
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if lines:
+                try:
+                    self._write_batch(lines)
+                except Exception:
+                    logger.exception(f"Could not write {len(lines)} log entries to {self.path}, they are dropped")
+            if stop:
+                return
+
+    def _write_batch(self, lines):
+        """Append a batch of lines with one write and flush, rotating first if the file is full"""
+        if self._file.closed:  # a previous rotation failed part way through
+            self._file = open(self.path, 'a', encoding='utf-8')
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+
+    def _rotate(self):
+        """Shift the existing backups up by one and start a new file"""
+        self._file.close()
+        for n in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{n}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{n + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+
+def parse_response(text: Optional[str]) -> Any:
+    """Return a Marketo response body as JSON so it is logged as an object instead of an escaped string"""
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return text
@@ -0,0 +1,622 @@
+"""
+Local stand-in for the Marketo REST and Bulk APIs used by the scripts
+
+Serves the endpoints the scripts in this repository call, backed by a
+deterministic in-memory data set, so throughput and concurrency changes can be
+benchmarked on a laptop without a live instance:
+
+    identity       GET  /identity/oauth/token
+    leads          GET  /rest/v1/leads.json (filterType=id)
+                   POST /rest/v1/leads.json (createOrUpdate / updateOnly)
+                   POST /rest/v1/leads/{id}/merge.json
+    programs       GET  /rest/asset/v1/programs.json (maxReturn, offset)
+                   GET  /rest/asset/v1/program/byName.json
+                   POST /rest/asset/v1/program/{id}.json
+    static lists   GET  /rest/asset/v1/staticLists.json
+                   GET  /rest/asset/v1/staticList/{id}.json
+                   GET  /rest/v1/lists/{id}/leads.json
+    activities     GET  /rest/v1/activities/pagingtoken.json
+                   GET  /rest/v1/activities.json
+    bulk export    GET  /bulk/v1/activities/export.json (status)
+                   POST /bulk/v1/activities/export/create.json
+                   POST /bulk/v1/activities/export/{id}/enqueue.json
+                   GET  /bulk/v1/activities/export/{id}/status.json
+                   GET  /bulk/v1/activities/export/{id}/file.json
+
+Like Marketo, errors come back as HTTP 200 with success=false and a code:
+601/602 for a bad or expired token, 606 when more than rate_limit calls were
+made in the last rate_window secs, 615 when more than concurrency_limit calls
+are in flight, 1029 when too many export jobs are queued. Latency, injected
+606/615 errors, page sizes, token life and export durations are configurable.
+
+Run it with e.g.
+
+    python mock_marketo.py --port 8080 --latency 0.05 --error-rate 0.01
+
+and point base_url at http://127.0.0.1:8080, or start it from a benchmark with
+MockMarketoServer(MockConfig(...)).start().
+"""
+
+import argparse
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_LIST_NAMES = [
+    "All Program Members",
+    "All Program Members in OneMAP",
+    "All Program Members in OneMAP AND In OneMap Program",
+    "All Program Members missing from OneMAP",
+    "All Program Members in OneMAP but NOT in Destination Program"
+]
+
+ACTIVITY_TYPES = [1, 2, 7, 10, 11]
+EXPORT_FIELDS = ['marketoGUID', 'leadId', 'activityDate', 'activityTypeId', 'campaignId',
+                 'primaryAttributeValueId', 'primaryAttributeValue', 'attributes']
+
+
+@dataclass
+class MockConfig:
+    """Behaviour and data set of the mock server"""
+    latency: float = 0.0  # secs added to every call
+    latency_jitter: float = 0.0  # up to this many extra secs, chosen at random per call
+    error_rate: float = 0.0  # share of calls that randomly fail with 606 or 615
+    enforce_limits: bool = True  # answer 606/615 when the real limits below are exceeded
+    rate_limit: int = 100
+    rate_window: float = 20
+    concurrency_limit: int = 10
+    token_life: int = 3600
+    page_size: int = 300  # max records per page of lists/{id}/leads and activities
+    export_secs: float = 5  # secs an enqueued export job takes to complete
+    max_queued_exports: int = 10
+    leads: int = 1000
+    programs: int = 200
+    list_names: List[str] = field(default_factory=lambda: list(DEFAULT_LIST_NAMES))
+    max_list_size: int = 1000
+    activities: int = 5000
+    seed: int = 7
+
+
+class MarketoError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class MockMarketo:
+    """In-memory data and the logic behind each endpoint, shared by the handler threads"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.calls = deque()
+        self.in_flight = 0
+        self.stats = {'calls': 0, 'errors': {}}
+        self.tokens = {}
+        self.jobs = {}
+        self.paging_tokens = {}
+        self._build_data()
+
+    def _build_data(self):
+        rng = random.Random(self.config.seed)
+        start = datetime(2018, 1, 1, tzinfo=timezone.utc)
+
+        self.leads = {}
+        for i in range(1, self.config.leads + 1):
+            self.leads[i] = {
+                'id': i,
+                'email': f"lead{i % max(self.config.leads // 2, 1)}@example.com",
+                'firstName': rng.choice(['Ann', 'Bob', 'Cleo', None]),
+                'lastName': rng.choice(['Smith', 'Jones', 'Lee', None]),
+                'sfdcLeadId': rng.choice([None, None, f"00Q{i:012d}"]),
+                'createdAt': _iso(start + timedelta(seconds=rng.randrange(5 * 365 * 86400))),
+            }
+
+        self.programs = {}
+        self.lists = {}
+        for p in range(1, self.config.programs + 1):
+            created = start + timedelta(days=rng.randrange(5 * 365))
+            self.programs[p] = {
+                'id': p, 'name': f"Program {p}", 'type': 'Default', 'channel': 'Webinar',
+                'createdAt': _iso(created, marketo_offset=True), 'updatedAt': _iso(created, marketo_offset=True),
+                'costs': [],
+            }
+            for n, name in enumerate(self.config.list_names):
+                list_id = p * 100 + n
+                self.lists[list_id] = {
+                    'id': list_id, 'name': name, 'program': p,
+                    'createdAt': _iso(created), 'updatedAt': _iso(created),
+                    'size': rng.randrange(self.config.max_list_size + 1),
+                }
+
+        self.activities = []
+        for a in range(1, self.config.activities + 1):
+            date = start + timedelta(seconds=rng.randrange(6 * 365 * 86400))
+            self.activities.append({
+                'marketoGUID': str(a), 'id': a, 'leadId': rng.randrange(1, self.config.leads + 1),
+                'activityDate': _iso(date), 'activityTypeId': rng.choice(ACTIVITY_TYPES),
+                'campaignId': rng.randrange(1, 50), 'primaryAttributeValueId': rng.randrange(1, 500),
+                'primaryAttributeValue': f"Asset {rng.randrange(1, 500)}",
+                'attributes': json.dumps([{'name': 'Webpage ID', 'value': rng.randrange(1, 100)}]),
+            })
+        self.activities.sort(key=lambda x: x['activityDate'])
+
+    # ---------------------------------------------------------------- limits
+
+    def enter(self, path: str):
+        """Count a call against the limits, raising 606/615 like Marketo when one is exceeded"""
+        with self.lock:
+            now = time.monotonic()
+            self.stats['calls'] += 1
+            while self.calls and now - self.calls[0] >= self.config.rate_window:
+                self.calls.popleft()
+
+            if path.startswith('/identity'):
+                return
+
+            if self.config.enforce_limits and self.in_flight >= self.config.concurrency_limit:
+                raise MarketoError('615', 'Concurrent access limit reached')
+            if self.config.enforce_limits and len(self.calls) >= self.config.rate_limit:
+                raise MarketoError('606', f"Max rate limit '{self.config.rate_limit}' exceeded with in "
+                                          f"'{int(self.config.rate_window)}' secs")
+            if self.config.error_rate and self.rng.random() < self.config.error_rate:
+                raise self.rng.choice([MarketoError('606', 'Max rate limit exceeded (injected)'),
+                                       MarketoError('615', 'Concurrent access limit reached (injected)')])
+            self.calls.append(now)
+            self.in_flight += 1
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def count_error(self, code: str):
+        with self.lock:
+            self.stats['errors'][code] = self.stats['errors'].get(code, 0) + 1
+
+    def delay(self):
+        secs = self.config.latency
+        if self.config.latency_jitter:
+            secs += random.random() * self.config.latency_jitter
+        if secs:
+            time.sleep(secs)
+
+    # ---------------------------------------------------------------- auth
+
+    def issue_token(self) -> Dict:
+        """Return the current token until it expires, like Marketo does"""
+        with self.lock:
+            now = time.time()
+            for token, expires_at in self.tokens.items():
+                if expires_at > now:
+                    return {'access_token': token, 'token_type': 'bearer', 'expires_in': int(expires_at - now),
+                            'scope': 'api@example.com'}
+            token = uuid.uuid4().hex + ':mock'
+            self.tokens[token] = now + self.config.token_life
+            return {'access_token': token, 'token_type': 'bearer', 'expires_in': self.config.token_life,
+                    'scope': 'api@example.com'}
+
+    def check_token(self, token: Optional[str]):
+        if not token or token not in self.tokens:
+            raise MarketoError('601', 'Access token invalid')
+        if self.tokens[token] <= time.time():
+            raise MarketoError('602', 'Access token expired')
+
+    # ---------------------------------------------------------------- leads
+
+    def get_leads(self, query: Dict[str, str]) -> List[Dict]:
+        if query.get('filterType') != 'id':
+            raise MarketoError('1003', 'Only filterType=id is supported by the mock')
+        fields = (query.get('fields') or 'id,email,firstName,lastName,updatedAt,createdAt').split(',')
+        ids = [int(x) for x in query.get('filterValues', '').split(',') if x]
+        if len(ids) > 300:
+            raise MarketoError('1003', 'Too many filter values')
+        with self.lock:
+            return [{f: self.leads[i].get(f) for f in fields} for i in ids if i in self.leads]
+
+    def update_leads(self, body: Dict) -> List[Dict]:
+        action = body.get('action', 'createOrUpdate')
+        results = []
+        with self.lock:
+            for record in body.get('input', [])[:300]:
+                lead_id = record.get('id')
+                if lead_id in self.leads:
+                    self.leads[lead_id].update(record)
+                    results.append({'id': lead_id, 'status': 'updated'})
+                elif action == 'updateOnly':
+                    results.append({'status': 'skipped', 'reasons': [{'code': '1004', 'message': 'Lead not found'}]})
+                else:
+                    new_id = max(self.leads, default=0) + 1
+                    self.leads[new_id] = dict(record, id=new_id)
+                    results.append({'id': new_id, 'status': 'created'})
+        return results
+
+    def merge(self, winner_id: int, query: Dict[str, str]):
+        losers = [int(x) for x in query.get('leadIds', '').split(',') if x]
+        crm = query.get('mergeInCRM', 'false').lower() == 'true'
+        if crm and len(losers) > 1:
+            raise MarketoError('1003', 'Only one lead can be merged at a time when mergeInCRM is true')
+        if len(losers) > 3:
+            raise MarketoError('1003', 'Too many leadIds')
+        with self.lock:
+            for lead_id in [winner_id] + losers:
+                if lead_id not in self.leads:
+                    raise MarketoError('1004', f"Lead '{lead_id}' not found")
+            for lead_id in losers:
+                del self.leads[lead_id]
+
+    # ---------------------------------------------------------------- programs and lists
+
+    def program_by_name(self, name: str) -> Tuple[List[Dict], List[str]]:
+        for program in self.programs.values():
+            if program['name'] == name:
+                return [_public(program)], []
+        return [], ['No assets found for the given search criteria.']
+
+    def browse_programs(self, query: Dict[str, str]) -> Tuple[List[Dict], List[str]]:
+        offset = int(query.get('offset', 0))
+        max_return = min(int(query.get('maxReturn', 20)), 200)
+        programs = [_public(x) for x in list(self.programs.values())[offset:offset + max_return]]
+        return (programs, []) if programs else ([], ['No assets found for the given search criteria.'])
+
+    def update_program(self, program_id: int, form: Dict[str, str]) -> List[Dict]:
+        if program_id not in self.programs:
+            raise MarketoError('702', 'No data found for the given search criteria')
+        with self.lock:
+            program = self.programs[program_id]
+            if form.get('costsDestructiveUpdate', 'false').lower() == 'true':
+                program['costs'] = []
+            if 'costs' in form:
+                program['costs'].extend(json.loads(form['costs'].replace("'", '"')))
+            program['updatedAt'] = _iso(datetime.now(timezone.utc), marketo_offset=True)
+            return [_public(program)]
+
+    def static_lists(self, query: Dict[str, str]) -> List[Dict]:
+        folder = json.loads(query.get('folder', '{}'))
+        offset = int(query.get('offset', 0))
+        max_return = min(int(query.get('maxReturn', 20)), 200)
+        lists = [x for x in self.lists.values() if not folder or x['program'] == folder.get('id')]
+        return [_public(x) for x in lists[offset:offset + max_return]]
+
+    def static_list(self, list_id: int) -> List[Dict]:
+        if list_id not in self.lists:
+            return []
+        return [_public(self.lists[list_id])]
+
+    def list_leads(self, list_id: int, query: Dict[str, str]) -> Dict:
+        if list_id not in self.lists:
+            raise MarketoError('1013', 'Static list not found')
+        batch = min(int(query.get('batchSize', self.config.page_size)), self.config.page_size)
+        start = int(query.get('nextPageToken') or 0)
+        size = self.lists[list_id]['size']
+        end = min(start + batch, size)
+        page = {'result': [{'id': i + 1} for i in range(start, end)], 'moreResult': end < size}
+        if end < size:
+            page['nextPageToken'] = str(end)
+        return page
+
+    # ---------------------------------------------------------------- activities
+
+    def paging_token(self, since: str) -> str:
+        since = _parse(since)
+        index = next((i for i, a in enumerate(self.activities) if _parse(a['activityDate']) >= since),
+                     len(self.activities))
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.paging_tokens[token] = index
+        return token
+
+    def activities_page(self, query: Dict[str, str], type_ids: List[int]) -> Dict:
+        token = query.get('nextPageToken')
+        with self.lock:
+            if token not in self.paging_tokens:
+                raise MarketoError('1003', 'Invalid nextPageToken')
+            index = self.paging_tokens[token]
+        batch = min(int(query.get('batchSize', self.config.page_size)), self.config.page_size)
+        result = []
+        while index < len(self.activities) and len(result) < batch:
+            if not type_ids or self.activities[index]['activityTypeId'] in type_ids:
+                result.append(self.activities[index])
+            index += 1
+        next_token = uuid.uuid4().hex
+        with self.lock:
+            self.paging_tokens[next_token] = index
+        return {'result': result, 'nextPageToken': next_token, 'moreResult': index < len(self.activities)}
+
+    # ---------------------------------------------------------------- bulk export
+
+    def create_export(self, body: Dict) -> List[Dict]:
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.jobs[job_id] = {'exportId': job_id, 'format': body.get('format', 'CSV'), 'status': 'Created',
+                                 'createdAt': _iso(datetime.now(timezone.utc)), 'filter': body.get('filter', {})}
+        return [self._job_view(job_id)]
+
+    def enqueue_export(self, job_id: str) -> List[Dict]:
+        with self.lock:
+            job = self._job(job_id)
+            queued = sum(1 for j in self.jobs.values() if j['status'] == 'Queued' and not self._done(j))
+            if queued >= self.config.max_queued_exports:
+                raise MarketoError('1029', 'Too many jobs in queue')
+            job['status'] = 'Queued'
+            job['queuedAt'] = time.time()
+        return [self._job_view(job_id)]
+
+    def list_exports(self, query: Dict[str, str]) -> List[Dict]:
+        statuses = set(query['status'].split(',')) if query.get('status') else None
+        with self.lock:
+            jobs = [self._job_view(job_id) for job_id in self.jobs]
+        return [job for job in jobs if statuses is None or job['status'] in statuses]
+
+    def export_status(self, job_id: str) -> List[Dict]:
+        with self.lock:
+            self._job(job_id)
+        return [self._job_view(job_id)]
+
+    def export_file(self, job_id: str) -> str:
+        with self.lock:
+            job = self._job(job_id)
+            if not self._done(job):
+                raise MarketoError('1003', 'Export job is not completed')
+        flt = job['filter']
+        created = flt.get('createdAt', {})
+        start, end = _parse(created.get('startAt')), _parse(created.get('endAt'))
+        type_ids = flt.get('activityTypeIds') or []
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for activity in self.activities:
+            date = _parse(activity['activityDate'])
+            if start and date < start or end and date >= end:
+                continue
+            if type_ids and activity['activityTypeId'] not in type_ids:
+                continue
+            writer.writerow(activity)
+        return out.getvalue()
+
+    def _job(self, job_id: str) -> Dict:
+        if job_id not in self.jobs:
+            raise MarketoError('1003', 'Export job not found')
+        return self.jobs[job_id]
+
+    def _done(self, job: Dict) -> bool:
+        return 'queuedAt' in job and time.time() - job['queuedAt'] >= self.config.export_secs
+
+    def _job_view(self, job_id: str) -> Dict:
+        job = self.jobs[job_id]
+        status = job['status']
+        if status == 'Queued' and 'queuedAt' in job:
+            elapsed = time.time() - job['queuedAt']
+            status = 'Completed' if elapsed >= self.config.export_secs else 'Processing'
+        return {'exportId': job_id, 'format': job['format'], 'status': status, 'createdAt': job['createdAt']}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes each request to MockMarketo and wraps the result in Marketo's response envelope"""
+
+    protocol_version = 'HTTP/1.1'
+    mock: MockMarketo = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        path = url.path
+
+        try:
+            self.mock.enter(path)
+        except MarketoError as e:
+            self.mock.count_error(e.code)
+            self._json(_error(e))
+            return
+
+        try:
+            self.mock.delay()
+            if path == '/identity/oauth/token':
+                self._json(self.mock.issue_token())
+                return
+
+            self.mock.check_token(self._token(query))
+            body = self._route(method, path, query, raw)
+            if isinstance(body, str):
+                self._send(200, body.encode('utf-8'), 'text/csv')
+            else:
+                self._json(dict({'requestId': uuid.uuid4().hex[:12], 'success': True}, **body))
+        except MarketoError as e:
+            self.mock.count_error(e.code)
+            self._json(_error(e))
+        except ValueError:
+            self.mock.count_error('609')
+            self._json(_error(MarketoError('609', 'Invalid JSON')))
+        finally:
+            if not path.startswith('/identity'):
+                self.mock.leave()
+
+    def _route(self, method: str, path: str, query: Dict[str, str], raw: bytes) -> Any:
+        mock = self.mock
+
+        if path == '/rest/v1/leads.json':
+            if method == 'GET':
+                return {'result': mock.get_leads(query)}
+            return {'result': mock.update_leads(json.loads(raw or b'{}'))}
+
+        match = re.fullmatch(r'/rest/v1/leads/(\d+)/merge\.json', path)
+        if match and method == 'POST':
+            mock.merge(int(match.group(1)), query)
+            return {}
+
+        if path == '/rest/asset/v1/programs.json':
+            result, warnings = mock.browse_programs(query)
+            return {'result': result, 'warnings': warnings} if warnings else {'result': result}
+
+        if path == '/rest/asset/v1/program/byName.json':
+            result, warnings = mock.program_by_name(query.get('name', ''))
+            return {'result': result, 'warnings': warnings} if warnings else {'result': result}
+
+        match = re.fullmatch(r'/rest/asset/v1/program/(\d+)\.json', path)
+        if match and method == 'POST':
+            form = {k: v[-1] for k, v in parse_qs(raw.decode('utf-8')).items()}
+            return {'result': mock.update_program(int(match.group(1)), form)}
+
+        if path == '/rest/asset/v1/staticLists.json':
+            return {'result': mock.static_lists(query)}
+
+        match = re.fullmatch(r'/rest/asset/v1/staticList/(\d+)\.json', path)
+        if match:
+            return {'result': mock.static_list(int(match.group(1)))}
+
+        match = re.fullmatch(r'/rest/v1/lists/(\d+)/leads\.json', path)
+        if match:
+            return mock.list_leads(int(match.group(1)), query)
+
+        if path == '/rest/v1/activities/pagingtoken.json':
+            return {'nextPageToken': mock.paging_token(query.get('sinceDatetime', ''))}
+
+        if path == '/rest/v1/activities.json':
+            values = parse_qs(urlparse(self.path).query).get('activityTypeIds', [])
+            type_ids = [int(x) for value in values for x in value.split(',') if x]
+            return mock.activities_page(query, type_ids)
+
+        if path == '/bulk/v1/activities/export.json':
+            return {'result': mock.list_exports(query)}
+
+        if path == '/bulk/v1/activities/export/create.json':
+            return {'result': mock.create_export(json.loads(raw or b'{}'))}
+
+        match = re.fullmatch(r'/bulk/v1/activities/export/([\w-]+)/(enqueue|status|file)\.json', path)
+        if match:
+            job_id, action = match.groups()
+            if action == 'enqueue':
+                return {'result': mock.enqueue_export(job_id)}
+            if action == 'status':
+                return {'result': mock.export_status(job_id)}
+            return mock.export_file(job_id)
+
+        raise MarketoError('404', f"The mock does not serve {method} {path}")
+
+    def _token(self, query: Dict[str, str]) -> Optional[str]:
+        auth = self.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            return auth[len('Bearer '):]
+        return query.get('access_token')
+
+    def _json(self, body: Dict):
+        self._send(200, json.dumps(body).encode('utf-8'), 'application/json;charset=UTF-8')
+
+    def _send(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockMarketoServer:
+    """Threaded HTTP server around MockMarketo, started in the background by start()"""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        self.mock = MockMarketo(config or MockConfig())
+        handler = type('Handler', (_Handler,), {'mock': self.mock})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockMarketoServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='MockMarketo', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def _error(e: MarketoError) -> Dict:
+    return {'requestId': uuid.uuid4().hex[:12], 'success': False, 'errors': [{'code': e.code, 'message': e.message}]}
+
+
+def _public(item: Dict) -> Dict:
+    """Drop the mock's own bookkeeping keys from a program or list"""
+    return {k: v for k, v in item.items() if k not in ('program', 'size')}
+
+
+def _iso(date: datetime, marketo_offset: bool = False) -> str:
+    """Marketo's two date formats, the asset API appends +0000 to the Z"""
+    text = date.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return text + '+0000' if marketo_offset else text
+
+
+def _parse(text: Optional[str]) -> Optional[datetime]:
+    if not text:
+        return None
+    date = datetime.fromisoformat(text.replace('Z+0000', '+00:00').replace('Z', '+00:00'))
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Marketo REST and Bulk APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='secs added to every call')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='up to this many random extra secs')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls failing with 606/615')
+    parser.add_argument('--no-limits', action='store_true', help='do not enforce the rate and concurrency limits')
+    parser.add_argument('--page-size', type=int, default=300)
+    parser.add_argument('--export-secs', type=float, default=5)
+    parser.add_argument('--token-life', type=int, default=3600)
+    parser.add_argument('--leads', type=int, default=1000)
+    parser.add_argument('--programs', type=int, default=200)
+    parser.add_argument('--activities', type=int, default=5000)
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                        enforce_limits=not args.no_limits, page_size=args.page_size, export_secs=args.export_secs,
+                        token_life=args.token_life, leads=args.leads, programs=args.programs,
+                        activities=args.activities)
+    server = MockMarketoServer(config, args.host, args.port)
+    print(f"Mock Marketo listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.mock.stats))
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
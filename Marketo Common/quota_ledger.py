@@ -0,0 +1,221 @@
+"""
+Ledger of the Marketo API quota spent per day, with a pre-flight planner
+
+Marketo allows 50,000 REST calls and 500 MB of bulk export files per day, the
+day resetting at midnight US Central time. Nothing stops a long run from
+spending both halfway through, so every call made through http_session (and
+the AsyncMarketoClient of Program Member Transition) is recorded here by
+endpoint, with the bytes it returned. The counts are kept in a SQLite file
+shared by every script and process on the machine, buffered in memory and
+written every flush_every calls or flush_secs secs and at exit.
+
+Before a run starts the script estimates what it will spend as one Estimate
+per unit of work (a merge group, a program, an export job) and asks preflight()
+how many of the leading units fit in what is left of today's quota. A run that
+can be split (e.g. BulkMerge.py, whose journal lets the next run pick up the
+remaining groups) runs only those, one that cannot is refused with
+QuotaExceeded before it makes a single call.
+
+    python quota_ledger.py [--days 7]
+
+prints the calls and bytes recorded per endpoint for the last days.
+"""
+
+import argparse
+import atexit
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TZ = ZoneInfo('America/Chicago')
+except Exception:  # no tz database, Central Standard Time is close enough
+    QUOTA_TZ = timezone(timedelta(hours=-6))
+
+DAILY_CALLS = 50000
+DAILY_EXPORT_BYTES = 500 * 1024 * 1024
+MB = 1024 * 1024
+
+# Calls kept back by preflight() for retries, token refreshes and anything else running on the same instance
+RESERVE_CALLS = 500
+
+# Ids in a path, so that e.g. /rest/v1/leads/123/merge.json and /rest/v1/leads/456/merge.json are one endpoint
+_IDS = re.compile(r'/(?:\d+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27})(?=/|\.json)')
+# Downloads counted against the bulk export quota
+_EXPORT_FILE = re.compile(r'^/bulk/v1/\w+/export/\{id\}/file\.json$')
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+class QuotaExceeded(RuntimeError):
+    """A run would spend more than what is left of today's quota"""
+
+
+@dataclass
+class Estimate:
+    """Calls and bulk export bytes one unit of work of a run is expected to spend"""
+    calls: float = 0
+    export_bytes: float = 0
+
+    def __add__(self, other: 'Estimate') -> 'Estimate':
+        return Estimate(self.calls + other.calls, self.export_bytes + other.export_bytes)
+
+    def __str__(self) -> str:
+        return f"{math.ceil(self.calls):,} calls and {self.export_bytes / MB:,.1f} MB of exports"
+
+
+class QuotaLedger:
+    """Calls and bytes spent per quota day and endpoint, persisted in SQLite"""
+
+    def __init__(self, path: Optional[str] = None, daily_calls: int = DAILY_CALLS,
+                 daily_export_bytes: int = DAILY_EXPORT_BYTES, flush_every: int = 100, flush_secs: float = 10):
+        if path is None:
+            cache_dir = os.environ.get('MKTO_CACHE_DIR') or os.path.expanduser(os.path.join('~', '.cache', 'marketo'))
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, 'quota.sqlite')
+        self.path = path
+        self.daily_calls = daily_calls
+        self.daily_export_bytes = daily_export_bytes
+        self.flush_every = flush_every
+        self.flush_secs = flush_secs
+        self._pending = {}
+        self._pending_calls = 0
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS usage (day TEXT, endpoint TEXT, calls INTEGER, bytes INTEGER, '
+                         'PRIMARY KEY (day, endpoint))')
+
+    def record(self, url: str, calls: int = 1, nbytes: int = 0):
+        """Count a call to url (identity calls are free) and the bytes it returned"""
+        path = urlparse(url).path
+        if path.startswith('/identity'):
+            return
+        key = (quota_day(), endpoint_name(path))
+        with self._lock:
+            counts = self._pending.setdefault(key, [0, 0])
+            counts[0] += calls
+            counts[1] += nbytes
+            self._pending_calls += calls
+            due = self._pending_calls >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_secs
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered counts to the ledger file"""
+        with self._lock:
+            pending, self._pending, self._pending_calls = self._pending, {}, 0
+            self._flushed_at = time.monotonic()
+            if not pending:
+                return
+            self._db.executemany('INSERT INTO usage VALUES (?, ?, ?, ?) ON CONFLICT(day, endpoint) DO UPDATE SET '
+                                 'calls = calls + excluded.calls, bytes = bytes + excluded.bytes',
+                                 [(day, endpoint, c, b) for (day, endpoint), (c, b) in pending.items()])
+
+    def usage(self, day: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """{endpoint: {'calls': ..., 'bytes': ...}} spent on day (today unless given) by every process"""
+        self.flush()
+        rows = self._db.execute('SELECT endpoint, calls, bytes FROM usage WHERE day = ? ORDER BY calls DESC',
+                                (day or quota_day(),)).fetchall()
+        return {endpoint: {'calls': calls, 'bytes': nbytes} for endpoint, calls, nbytes in rows}
+
+    def spent(self, day: Optional[str] = None) -> Estimate:
+        """Calls and bulk export bytes spent on day (today unless given)"""
+        total = Estimate()
+        for endpoint, counts in self.usage(day).items():
+            total += Estimate(counts['calls'], counts['bytes'] if _EXPORT_FILE.match(endpoint) else 0)
+        return total
+
+    def remaining(self) -> Estimate:
+        """Calls and bulk export bytes left today"""
+        spent = self.spent()
+        return Estimate(max(self.daily_calls - spent.calls, 0), max(self.daily_export_bytes - spent.export_bytes, 0))
+
+    def average_bytes(self, endpoint: str) -> Optional[float]:
+        """Average bytes returned by a call to endpoint over the whole ledger, None if it was never called"""
+        self.flush()
+        calls, nbytes = self._db.execute('SELECT SUM(calls), SUM(bytes) FROM usage WHERE endpoint = ?',
+                                         (endpoint,)).fetchone()
+        return nbytes / calls if calls else None
+
+    def history(self, days: int = 7) -> List[tuple]:
+        """(day, endpoint, calls, bytes) rows of the last days, newest first"""
+        self.flush()
+        since = (datetime.now(QUOTA_TZ) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        return self._db.execute('SELECT day, endpoint, calls, bytes FROM usage WHERE day >= ? '
+                                'ORDER BY day DESC, calls DESC', (since,)).fetchall()
+
+
+def preflight(estimates: Iterable[Estimate], split: bool = True, ledger: Optional[QuotaLedger] = None,
+              reserve_calls: int = RESERVE_CALLS) -> int:
+    """Number of the leading units of work that fit in today's remaining quota, less reserve_calls.
+
+    estimates is consumed in a single pass, so it can be a generator over more units than fit in memory.
+    Raises QuotaExceeded if not even the first unit fits, or if split is False and not all of them fit.
+    """
+    ledger = ledger or get_ledger()
+    left = ledger.remaining()
+    left.calls = max(left.calls - reserve_calls, 0)
+
+    units = 0
+    fits = 0
+    total = Estimate()
+    for estimate in estimates:
+        total += estimate
+        units += 1
+        if fits == units - 1 and total.calls <= left.calls and total.export_bytes <= left.export_bytes:
+            fits += 1
+
+    if fits == units:
+        return fits
+    message = f"the run needs about {total}, only {left} are left today (quota resets at midnight US Central)"
+    if not split or fits == 0:
+        raise QuotaExceeded(message)
+    return fits
+
+
+def quota_day(now: Optional[datetime] = None) -> str:
+    """The Marketo quota day (US Central date) of now"""
+    return (now or datetime.now(timezone.utc)).astimezone(QUOTA_TZ).strftime('%Y-%m-%d')
+
+
+def endpoint_name(path: str) -> str:
+    """The path of a call with its asset, lead and export job ids replaced by {id}"""
+    return _IDS.sub('/{id}', path)
+
+
+def get_ledger() -> QuotaLedger:
+    """The ledger shared by every helper of the process, opened on first use and flushed at exit"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = QuotaLedger()
+                atexit.register(_ledger.flush)
+    return _ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+
+    ledger = get_ledger()
+    for day, endpoint, calls, nbytes in ledger.history(args.days):
+        print(f"{day}  {calls:>8,} calls  {nbytes / MB:>10,.1f} MB  {endpoint}")
+    spent, left = ledger.spent(), ledger.remaining()
+    print(f"\ntoday: spent {spent}, {left} left")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Cache of Marketo asset lookups that rarely change
+
+Static list metadata is fetched again for every program on every run.
+ResponseCache keeps successful GET responses in an in-memory LRU in front of a
+SQLite file, so reruns over the same programs are served locally:
+
+- every endpoint has its own time to live (TTLS), after which the response is
+  fetched again. If Marketo sent an ETag the stale entry is revalidated with
+  If-None-Match and a 304 just renews it
+- a response about a single asset is tagged with the asset's id and updatedAt,
+  invalidate() drops it as soon as a newer updatedAt is seen elsewhere (e.g. in
+  the response of a list of static lists)
+
+The key is the URL and its params without the access token, so the cache is
+shared by every run against the same instance. get() takes the same arguments
+as http_session.get() and returns a requests.Response either way.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+import requests
+
+import http_session
+
+HOUR = 3600
+
+# Secs a response of each endpoint is used before it is fetched again
+TTLS = {
+    'staticLists': HOUR,
+    'staticList': 24 * HOUR,
+}
+DEFAULT_TTL = HOUR
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ResponseCache:
+    """In-memory LRU in front of a persistent SQLite store of GET responses"""
+
+    def __init__(self, path: Optional[str] = None, ttls: Optional[Dict[str, float]] = None, max_entries: int = 1024):
+        if path is None:
+            cache_dir = os.environ.get('MKTO_CACHE_DIR') or os.path.expanduser(os.path.join('~', '.cache', 'marketo'))
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, 'responses.sqlite')
+        self.path = path
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, asset_id TEXT, '
+                         'updated_at TEXT, etag TEXT, body BLOB, stored_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_asset ON responses (endpoint, asset_id)')
+
+    def get(self, url: str, endpoint: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+            **kwargs) -> requests.Response:
+        """Return the cached response while it is fresh, else fetch it and cache it if it succeeded"""
+        key = cache_key(url, params)
+        entry = self._entry(key)
+        if entry and time.time() - entry['stored_at'] < self._ttl(endpoint):
+            self.hits += 1
+            return _response(url, entry['body'])
+
+        self.misses += 1
+        if entry and entry['etag']:
+            headers = dict(headers or {}, **{'If-None-Match': entry['etag']})
+        response = http_session.get(url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self._save(key, dict(entry, stored_at=time.time()))
+            return _response(url, entry['body'])
+        self.store(key, endpoint, response.content, response.headers.get('ETag'))
+        return response
+
+    def lookup(self, key: str, endpoint: str) -> Optional[bytes]:
+        """The body of a fresh cached response, for callers that make the call themselves (e.g. with aiohttp)"""
+        entry = self._entry(key)
+        if entry and time.time() - entry['stored_at'] < self._ttl(endpoint):
+            self.hits += 1
+            return entry['body']
+        self.misses += 1
+        return None
+
+    def store(self, key: str, endpoint: str, body: bytes, etag: Optional[str] = None):
+        """Cache a response body if it is a successful Marketo response with at least one result"""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return
+        result = data.get('result') or []
+        if not data.get('success') or not result:
+            return
+
+        asset_id = updated_at = None
+        if len(result) == 1:
+            asset_id = str(result[0].get('id'))
+            updated_at = result[0].get('updatedAt')
+        self._save(key, {'endpoint': endpoint, 'asset_id': asset_id, 'updated_at': updated_at, 'etag': etag,
+                         'body': body, 'stored_at': time.time()})
+
+    def invalidate(self, endpoint: str, asset_id, updated_at: Optional[str] = None):
+        """Drop the responses about an asset unless they were cached at the given updatedAt"""
+        asset_id = str(asset_id)
+        with self._lock:
+            for key, entry in list(self._memory.items()):
+                if entry['endpoint'] == endpoint and entry['asset_id'] == asset_id \
+                        and (updated_at is None or entry['updated_at'] != updated_at):
+                    del self._memory[key]
+            self._db.execute('DELETE FROM responses WHERE endpoint = ? AND asset_id = ? AND '
+                             '(? IS NULL OR updated_at IS NOT ?)', (endpoint, asset_id, updated_at, updated_at))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute('DELETE FROM responses')
+
+    def _ttl(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint, DEFAULT_TTL)
+
+    def _entry(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self._db.execute('SELECT endpoint, asset_id, updated_at, etag, body, stored_at FROM responses '
+                                   'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            entry = dict(zip(('endpoint', 'asset_id', 'updated_at', 'etag', 'body', 'stored_at'), row))
+            self._remember(key, entry)
+            return entry
+
+    def _save(self, key: str, entry: Dict):
+        with self._lock:
+            self._remember(key, entry)
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, entry['endpoint'], entry['asset_id'], entry['updated_at'], entry['etag'],
+                              entry['body'], entry['stored_at']))
+
+    def _remember(self, key: str, entry: Dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+def cache_key(url: str, params: Optional[Dict] = None) -> str:
+    """The URL and its params in a fixed order, without the access token"""
+    params = sorted((k, str(v)) for k, v in (params or {}).items() if k != 'access_token')
+    return url + ('?' + urlencode(params) if params else '')
+
+
+def get_cache() -> ResponseCache:
+    """The cache shared by every helper of the process, opened on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def _response(url: str, body: bytes) -> requests.Response:
+    """Rebuild a requests.Response from a cached body"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'application/json;charset=UTF-8'
+    response.headers['X-Cache'] = 'HIT'
+    return response
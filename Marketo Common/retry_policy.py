@@ -0,0 +1,96 @@
+"""
+Retry policy for Marketo API calls, keyed on Marketo's error codes
+
+Marketo answers most failures with HTTP 200, success=false and an error code,
+so retries are decided on the code rather than the HTTP status:
+
+    601, 602    access token invalid or expired  -> refresh the token and retry at once
+    606, 615    rate or concurrency limit hit    -> back off exponentially with full jitter
+    604, 608    request timed out / unavailable  -> retry after a short backoff
+    1029        too many bulk export jobs queued -> defer for defer_delay secs, then retry
+
+Connection errors, 429 and 5xx responses are retried like 606/615. Read
+timeouts are only retried for GET requests, a POST that timed out may still
+have been applied. http_session.request() applies DEFAULT_POLICY to every call.
+
+A 604 or 608 means Marketo gave up waiting on the call, not that it was not
+applied, so calls that must not be applied twice (merges, lead upserts) pass
+NON_IDEMPOTENT_POLICY, which does not retry those codes. http_session.request()
+also only retries such a call after a failure that happened before it was sent
+(a connection that could not be opened or a 429), not after a 5xx response or
+a connection dropped mid request.
+"""
+
+import json
+import logging
+import random
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+REFRESH = 'refresh'
+BACKOFF = 'backoff'
+RETRY = 'retry'
+DEFER = 'defer'
+
+ERROR_ACTIONS = {
+    '601': REFRESH,
+    '602': REFRESH,
+    '606': BACKOFF,
+    '615': BACKOFF,
+    '604': RETRY,
+    '608': RETRY,
+    '1029': DEFER,
+}
+
+_FAILED = re.compile(rb'"success"\s*:\s*false')
+
+
+@dataclass
+class RetryPolicy:
+    """How often and how long to wait before retrying each kind of failure"""
+    max_attempts: int = 6  # attempts per call for refresh, backoff and retry failures
+    base_delay: float = 1.0  # secs, doubled on every backoff attempt
+    max_delay: float = 60.0
+    retry_delay: float = 2.0  # secs before retrying a 604/608 or a network error
+    defer_delay: float = 60.0  # secs to wait for the export queue to drain
+    max_defers: int = 30
+    idempotent: bool = True  # False to not retry failures after which the call may have been applied
+
+    def classify(self, codes: List[str]) -> Optional[str]:
+        """The action for the first retryable code of a failed response, None if it should not be retried"""
+        for code in codes:
+            if str(code) in ERROR_ACTIONS:
+                action = ERROR_ACTIONS[str(code)]
+                return action if self.idempotent or action != RETRY else None
+        return None
+
+    def delay(self, action: str, attempt: int) -> float:
+        """Secs to wait before the next attempt, attempt counts from 1"""
+        if action == REFRESH:
+            return 0.0
+        if action == BACKOFF:
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if action == DEFER:
+            return self.defer_delay
+        return self.retry_delay * random.uniform(0.5, 1.5)
+
+    def attempts(self, action: str) -> int:
+        return self.max_defers if action == DEFER else self.max_attempts
+
+
+def error_codes(content: bytes) -> List[str]:
+    """Error codes of a Marketo response body, an empty list when the call succeeded or the body is not JSON"""
+    if not content or not _FAILED.search(content[:4096]):
+        return []
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return []
+    return [str(error.get('code')) for error in data.get('errors', [])]
+
+
+DEFAULT_POLICY = RetryPolicy()
+NON_IDEMPOTENT_POLICY = RetryPolicy(idempotent=False)
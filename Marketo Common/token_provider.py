@@ -0,0 +1,186 @@
+"""
+Marketo access tokens shared by every thread and process of the scripts
+
+Marketo hands out the same access token until it expires, so asking for a new
+one early only returns the old token with less life left. Instead of every
+script sleeping out the last minute of its token, one TokenProvider per
+instance keeps the token in memory for its threads and in a locked file cache
+for the other processes on the machine, and a background thread fetches the
+next token the moment the current one lapses. Until then callers keep getting
+the current token, even in its last seconds, so they only ever block on the
+very first token (or when the background refresh has fallen behind), and a
+process never calls the identity endpoint while another process already holds
+a valid token. A call that reaches Marketo just after its token expired gets
+601/602 and is retried with the new token by http_session.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+import http_session
+
+try:
+    import fcntl
+except ImportError:  # Windows, the cache is then only shared by the threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TokenProvider:
+    """Valid access token for one Marketo instance and API user, refreshed in the background"""
+
+    def __init__(self, base_url: str, client_id: str, client_secret: str, cache_dir: Optional[str] = None,
+                 timeout: float = 30, background: bool = True):
+        self.identity_url = base_url.rstrip('/') + '/identity/oauth/token'
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.background = background
+
+        cache_dir = cache_dir or os.environ.get('MKTO_TOKEN_CACHE_DIR') or tempfile.gettempdir()
+        name = hashlib.sha256((self.identity_url + client_id).encode('utf-8')).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir, f"marketo_token_{name}.json")
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        http_session.register_token_provider(urlparse(self.identity_url).netloc, self)
+
+    def get(self) -> str:
+        """Return the current token until it expires, only blocking when there is no valid token"""
+        while True:
+            token, expires_at = self._token, self._expires_at
+            if token and expires_at > time.time():
+                return token
+
+            with self._lock:
+                if not self._token or self._expires_at <= time.time():
+                    self._token, self._expires_at = self._load_or_fetch()
+                self._start()
+                if self._expires_at > time.time():
+                    return self._token
+
+            # Marketo handed out the old token in its very last moment, the next one is issued right after
+            time.sleep(0.5)
+
+    def expires_in(self) -> float:
+        """Seconds of life left on the current token"""
+        return max(self._expires_at - time.time(), 0)
+
+    def invalidate(self, token: Optional[str] = None):
+        """Drop a token that Marketo rejected (e.g. error 601 or 602) so the next get() fetches a new one"""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token, self._expires_at = None, 0.0
+            with self._file_lock():
+                cached = self._read_cache()
+                if cached and (token is None or cached[0] == token):
+                    self._write_cache(None, 0.0)
+
+    def refresh(self, rejected: str) -> str:
+        """Return a token to use instead of one Marketo rejected, a new one unless it was already replaced"""
+        token, expires_at = self._token, self._expires_at
+        if token and token != rejected and expires_at > time.time():
+            return token
+        self.invalidate(rejected)
+        return self.get()
+
+    def close(self):
+        """Stop the background refresh"""
+        self._stop.set()
+
+    def _start(self):
+        """Start the background refresh once there is a token to keep fresh"""
+        if self.background and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='TokenProvider', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Fetch the next token as soon as the current one expires, the only place that waits for it"""
+        while not self._stop.wait(max(self._expires_at - time.time(), 0)):
+            try:
+                with self._lock:
+                    if self._expires_at <= time.time():
+                        self._token, self._expires_at = self._load_or_fetch()
+                if self._expires_at <= time.time():
+                    self._stop.wait(0.5)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Background token refresh failed, retrying: {e}")
+                self._stop.wait(5)
+
+    def _load_or_fetch(self) -> Tuple[str, float]:
+        """Use the token cached by another process if it is still valid, else get a new one and cache it"""
+        with self._file_lock():
+            cached = self._read_cache()
+            if cached and cached[0] and cached[1] > time.time():
+                return cached
+
+            token, expires_at = self._fetch()
+            self._write_cache(token, expires_at)
+            return token, expires_at
+
+    def _fetch(self) -> Tuple[str, float]:
+        """Call the identity endpoint once, Marketo returns the current token until it has expired"""
+        params = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret
+        }
+        resp = http_session.get(self.identity_url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        data = resp.json()
+
+        expires_in = data.get('expires_in', 3600)
+        logger.info(f"Got a Marketo access token valid for {expires_in} secs")
+        return data['access_token'], time.time() + expires_in
+
+    def _read_cache(self) -> Optional[Tuple[str, float]]:
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data['access_token'], data['expires_at']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_cache(self, token: Optional[str], expires_at: float):
+        """Replace the cache file atomically so a reader never sees half a token, readable by this user only"""
+        tmp = self.cache_path + f".{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'access_token': token, 'expires_at': expires_at}, f)
+        os.replace(tmp, self.cache_path)
+
+    def _file_lock(self):
+        return _FileLock(self.cache_path + '.lock')
+
+
+class _FileLock:
+    """Exclusive lock held across processes while the cache is read and refreshed"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        return False
@@ -14,13 +14,30 @@ Version: 1.3 - Fixed member count retrieval
 import os
 import sys
 import json
+import asyncio
 import csv
 import time
 import logging
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime
+from collections import deque
 from typing import List, Dict, Set, Tuple, Optional
 
+try:
+    import aiohttp
+except ImportError:  # only needed for AsyncStaticListExporter
+    aiohttp = None
+
+# Shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+import http_session
+from api_metrics import get_metrics
+from quota_ledger import Estimate, QuotaExceeded, get_ledger, preflight
+from response_cache import cache_key, get_cache
+from retry_policy import BACKOFF, DEFAULT_POLICY, REFRESH, RETRY, error_codes
+from token_provider import TokenProvider
+
 # ============================================
 # CONFIGURATION
 # ============================================
@@ -39,6 +56,14 @@ LIST_URL_SUFFIX = "A1LA1"
 API_TIMEOUT = 30
 RATE_LIMIT_PAUSE = 0.5
 MAX_BATCH_SIZE = 300  # Marketo's max batch size for leads endpoint
+MAX_CONCURRENT_CALLS = 10  # Marketo's limit of API calls in flight at the same time
+MAX_CALLS_PER_WINDOW = 100  # Marketo's limit of API calls per RATE_WINDOW secs
+RATE_WINDOW = 20
+RATE_MARGIN = 1  # secs added to RATE_WINDOW, calls reach Marketo with some skew and 606 if it counts 101
+ESTIMATED_PAGES_PER_LIST = 4  # pages of MAX_BATCH_SIZE members counted per list, to estimate the calls of a run
+
+# Export the programs concurrently with AsyncStaticListExporter (requires aiohttp), else one call at a time
+ASYNC_EXPORT = True
 
 # Static list names to look for (exact matches)
 TARGET_LIST_NAMES = [
@@ -49,6 +74,15 @@ TARGET_LIST_NAMES = [
     "All Program Members in OneMAP but NOT in Destination Program"
 ]
 
+# Key each target list is stored under in the results
+LIST_KEYS = {
+    "All Program Members": "all_members",
+    "All Program Members in OneMAP": "in_onemap",
+    "All Program Members in OneMAP AND In OneMap Program": "in_both",
+    "All Program Members missing from OneMAP": "missing_from_onemap",
+    "All Program Members in OneMAP but NOT in Destination Program": "in_onemap_not_in_dest"
+}
+
 # ============================================
 # LOGGING SETUP
 # ============================================
@@ -64,51 +98,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ============================================
-# OAUTH TOKEN MANAGER (from main script)
-# ============================================
-class OAuthToken:
-    """Manages authentication tokens for Marketo API access"""
-
-    def __init__(self, munchkin: str, client_id: str, client_secret: str):
-        self.identity_url = f"https://{munchkin}.mktorest.com/identity"
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.token = None
-        self.expiry = datetime.utcnow()
-
-    def get(self) -> str:
-        """Get a valid token, refreshing if needed"""
-        if not self.token or datetime.utcnow() >= self.expiry:
-            self._refresh_token()
-        return self.token
-
-    def _refresh_token(self):
-        """Get a new authentication token from Marketo"""
-        url = f"{self.identity_url}/oauth/token"
-        params = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret
-        }
-
-        logger.info(f"Getting new authentication token...")
-
-        try:
-            resp = requests.get(url, params=params, timeout=API_TIMEOUT)
-            resp.raise_for_status()
-
-            data = resp.json()
-            self.token = data['access_token']
-            expires_in = data.get('expires_in', 3600) - 600  # 10 minute buffer
-            self.expiry = datetime.utcnow() + timedelta(seconds=expires_in)
-
-            logger.info("[SUCCESS] Successfully authenticated with Marketo")
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[ERROR] Failed to authenticate with Marketo: {str(e)}")
-            raise
-
 # ============================================
 # MARKETO CLIENT (from main script)
 # ============================================
@@ -117,7 +106,8 @@ class MarketoClient:
 
     def __init__(self, munchkin: str, client_id: str, client_secret: str, instance_name: str = ""):
         self.instance_name = instance_name
-        self.token_manager = OAuthToken(munchkin, client_id, client_secret)
+        self.token_manager = TokenProvider(f"https://{munchkin}.mktorest.com", client_id, client_secret,
+                                           timeout=API_TIMEOUT)
         self.rest_base = f"https://{munchkin}.mktorest.com/rest/v1"
         self.asset_base = f"https://{munchkin}.mktorest.com/rest/asset/v1"
 
@@ -168,12 +158,15 @@ class StaticListExporter(MarketoClient):
         }
 
         try:
-            resp = requests.get(url, headers=self._headers(), params=params, timeout=API_TIMEOUT)
+            # Served from the response cache when the same program was looked up recently (see response_cache.py)
+            resp = get_cache().get(url, 'staticLists', headers=self._headers(), params=params, timeout=API_TIMEOUT)
             data = self._handle_response(resp, f"Get static lists in program {program_id}")
 
             lists = []
             if 'result' in data:
                 for item in data['result']:
+                    # A list whose updatedAt moved on since its info was cached is fetched again
+                    get_cache().invalidate('staticList', item.get('id'), item.get('updatedAt'))
                     lists.append({
                         'id': item.get('id'),
                         'name': item.get('name'),
@@ -209,7 +202,7 @@ class StaticListExporter(MarketoClient):
                 if next_page_token:
                     params['nextPageToken'] = next_page_token
 
-                resp = requests.get(url, headers=self._headers(), params=params, timeout=API_TIMEOUT)
+                resp = http_session.get(url, headers=self._headers(), params=params, timeout=API_TIMEOUT)
                 data = self._handle_response(resp, f"Get members for list {list_id} (page {page})")
 
                 # Count the results in this batch
@@ -239,7 +232,7 @@ class StaticListExporter(MarketoClient):
         url = f"{self.asset_base}/staticList/{list_id}.json"
 
         try:
-            resp = requests.get(url, headers=self._headers(), timeout=API_TIMEOUT)
+            resp = get_cache().get(url, 'staticList', headers=self._headers(), timeout=API_TIMEOUT)
             data = self._handle_response(resp, f"Get info for list {list_id}")
 
             if 'result' in data and len(data['result']) > 0:
@@ -286,16 +279,7 @@ class StaticListExporter(MarketoClient):
                     member_count = self.get_list_member_count(list_item['id'])
 
                     # Create a key based on the list purpose
-                    if list_name == "All Program Members":
-                        key = "all_members"
-                    elif list_name == "All Program Members in OneMAP":
-                        key = "in_onemap"
-                    elif list_name == "All Program Members in OneMAP AND In OneMap Program":
-                        key = "in_both"
-                    elif list_name == "All Program Members missing from OneMAP":
-                        key = "missing_from_onemap"
-                    elif list_name == "All Program Members in OneMAP but NOT in Destination Program":
-                        key = "in_onemap_not_in_dest"
+                    key = LIST_KEYS[list_name]
 
                     # Generate the list URL
                     list_url = f"{INSTANCE_A_BASE_URL}{list_info['id']}{LIST_URL_SUFFIX}"
@@ -328,6 +312,289 @@ class StaticListExporter(MarketoClient):
             'missing_lists': list(missing_lists)
         }
 
+# ============================================
+# ASYNC MARKETO CLIENT
+# ============================================
+class AsyncRateWindow:
+    """Sliding window of MAX_CALLS_PER_WINDOW calls per RATE_WINDOW + RATE_MARGIN secs shared by the tasks of one
+    event loop. Like the RateLimiter of Bulk Merge a call counts from the moment its response arrived, calls still
+    in flight count as well"""
+
+    def __init__(self, calls: int = MAX_CALLS_PER_WINDOW, period: float = RATE_WINDOW, margin: float = RATE_MARGIN):
+        self.calls = calls
+        self.period = period + margin
+        self._spent = deque()
+        self._in_flight = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait until one more call fits in the window and count it as in flight"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._spent and now - self._spent[0] >= self.period:
+                    self._spent.popleft()
+                if len(self._spent) + self._in_flight < self.calls:
+                    self._in_flight += 1
+                    return
+                await asyncio.sleep(self.period - (now - self._spent[0]) if self._spent else 0.05)
+
+    def release(self):
+        """The response of a counted call arrived, it leaves the window period secs from now"""
+        self._in_flight -= 1
+        self._spent.append(time.monotonic())
+
+
+class AsyncMarketoClient:
+    """asyncio counterpart of MarketoClient
+
+    Any number of calls can be awaited at the same time, e.g. with asyncio.gather over
+    thousands of programs. A semaphore keeps at most max_concurrency of them in flight
+    against Marketo's limit of 10 concurrent calls and AsyncRateWindow keeps them under
+    100 calls per 20 secs. Use it as "async with AsyncStaticListExporter(...) as exporter:"
+    so the connection pool is opened and closed with the event loop.
+    """
+
+    def __init__(self, munchkin: str, client_id: str, client_secret: str, instance_name: str = "",
+                 max_concurrency: int = MAX_CONCURRENT_CALLS):
+        if aiohttp is None:
+            raise ImportError("AsyncMarketoClient requires aiohttp, install it with: pip install aiohttp")
+        self.instance_name = instance_name
+        self.token_manager = TokenProvider(f"https://{munchkin}.mktorest.com", client_id, client_secret,
+                                           timeout=API_TIMEOUT)
+        self.rest_base = f"https://{munchkin}.mktorest.com/rest/v1"
+        self.asset_base = f"https://{munchkin}.mktorest.com/rest/asset/v1"
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._window = AsyncRateWindow()
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=API_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        return False
+
+    async def _headers(self) -> Dict[str, str]:
+        """Get headers with current authentication token, only the very first token is waited for"""
+        token = await asyncio.to_thread(self.token_manager.get)
+        return {
+            'Authorization': f"Bearer {token}",
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+
+    async def _handle_response(self, response: "aiohttp.ClientResponse", operation: str) -> Dict:
+        """Check if Marketo API call was successful and return the data"""
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientResponseError as e:
+            logger.error(f"[ERROR] HTTP error during {operation}: {str(e)}")
+            raise
+
+        try:
+            data = await response.json(content_type=None)
+        except json.JSONDecodeError as e:
+            logger.error(f"[ERROR] Invalid JSON response during {operation}")
+            raise
+
+        if not data.get('success', True):
+            errors = data.get('errors', [])
+            if errors:
+                error_msg = errors[0].get('message', 'Unknown error')
+                error_code = errors[0].get('code', 'Unknown')
+                logger.error(f"[ERROR] Marketo API error during {operation}: [{error_code}] {error_msg}")
+                raise RuntimeError(f"{operation} failed: {error_msg}")
+
+        return data
+
+    async def _get(self, url: str, operation: str, params: Optional[Dict] = None,
+                   cache_endpoint: Optional[str] = None) -> Dict:
+        """GET a Marketo endpoint once there is a free concurrent slot and room in the rate window, retrying
+        rejected tokens, throttling, HTTP 429/5xx, connection errors and timeouts like http_session does (see
+        retry_policy.py). With a cache_endpoint a fresh response from the response cache is used instead and new
+        ones are cached"""
+        key = cache_key(url, params)
+        if cache_endpoint:
+            body = get_cache().lookup(key, cache_endpoint)
+            if body is not None:
+                return json.loads(body)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            async with self._semaphore:
+                headers = await self._headers()
+                await self._window.wait()
+                started = time.monotonic()
+                try:
+                    async with self._session.get(url, headers=headers, params=params) as resp:
+                        body = await resp.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    get_metrics().observe('GET', url, time.monotonic() - started)
+                    if attempt >= DEFAULT_POLICY.max_attempts:
+                        raise
+                    resp = None
+                    action, reason = RETRY, type(e).__name__
+                finally:
+                    self._window.release()
+
+            if resp is not None:
+                codes = error_codes(body) if resp.status < 400 else []
+                get_metrics().observe('GET', url, time.monotonic() - started, resp.status, len(body), 0, codes)
+                get_ledger().record(url, nbytes=len(body))
+                if resp.status == 429 or resp.status >= 500:
+                    action, reason = BACKOFF, f"HTTP {resp.status}"
+                else:
+                    action, reason = DEFAULT_POLICY.classify(codes), ','.join(codes)
+                if action is None or attempt >= DEFAULT_POLICY.attempts(action):
+                    data = await self._handle_response(resp, operation)
+                    if cache_endpoint:
+                        get_cache().store(key, cache_endpoint, body, resp.headers.get('ETag'))
+                    return data
+
+            if action == REFRESH:
+                await asyncio.to_thread(self.token_manager.refresh, headers['Authorization'][len('Bearer '):])
+            wait = DEFAULT_POLICY.delay(action, attempt)
+            get_metrics().retry('GET', url)
+            logger.warning(f"[RETRY] {operation} failed ({reason}), {action} attempt {attempt} in {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+
+class AsyncStaticListExporter(AsyncMarketoClient):
+    """Exports static list information from programs, many programs and lists at a time"""
+
+    async def get_program_static_lists(self, program_id: int) -> List[Dict]:
+        """Get all static lists in a program"""
+        url = f"{self.asset_base}/staticLists.json"
+        params = {
+            'folder': json.dumps({"id": program_id, "type": "Program"}),
+            'maxReturn': 200
+        }
+
+        try:
+            data = await self._get(url, f"Get static lists in program {program_id}", params, 'staticLists')
+
+            lists = []
+            if 'result' in data:
+                for item in data['result']:
+                    get_cache().invalidate('staticList', item.get('id'), item.get('updatedAt'))
+                    lists.append({
+                        'id': item.get('id'),
+                        'name': item.get('name'),
+                        'createdAt': item.get('createdAt'),
+                        'updatedAt': item.get('updatedAt')
+                    })
+
+            return lists
+
+        except Exception as e:
+            logger.error(f"Failed to get static lists for program {program_id}: {str(e)}")
+            return []
+
+    async def get_list_member_count(self, list_id: int) -> int:
+        """Get the actual count of members in a static list by paginating through all members"""
+        url = f"{self.rest_base}/lists/{list_id}/leads.json"
+        params = {
+            'fields': 'id',  # Only get IDs to minimize data transfer
+            'batchSize': MAX_BATCH_SIZE
+        }
+
+        total_count = 0
+        page = 0
+
+        try:
+            while True:
+                page += 1
+                data = await self._get(url, f"Get members for list {list_id} (page {page})", params)
+
+                # Count the results in this batch
+                if 'result' in data:
+                    batch_count = len(data['result'])
+                    total_count += batch_count
+                    logger.debug(f"  List {list_id} - Page {page}: {batch_count} members")
+
+                # The pages of one list follow each other, the other lists are paged at the same time
+                if data.get('moreResult', False) and data.get('nextPageToken'):
+                    params['nextPageToken'] = data['nextPageToken']
+                else:
+                    break
+
+            logger.info(f"  Total members in list {list_id}: {total_count}")
+            return total_count
+
+        except Exception as e:
+            logger.error(f"Failed to get member count for list {list_id}: {str(e)}")
+            return 0
+
+    async def get_list_info(self, list_id: int) -> Dict:
+        """Get detailed information about a static list"""
+        url = f"{self.asset_base}/staticList/{list_id}.json"
+
+        try:
+            data = await self._get(url, f"Get info for list {list_id}", cache_endpoint='staticList')
+
+            if 'result' in data and len(data['result']) > 0:
+                list_info = data['result'][0]
+                return {
+                    'id': list_info.get('id'),
+                    'name': list_info.get('name'),
+                    'createdAt': list_info.get('createdAt'),
+                    'updatedAt': list_info.get('updatedAt')
+                }
+
+            return {}
+
+        except Exception as e:
+            logger.error(f"Failed to get info for list {list_id}: {str(e)}")
+            return {}
+
+    async def _export_list(self, list_item: Dict) -> Optional[Tuple[str, Dict]]:
+        """Get the info and member count of one target list"""
+        list_name = list_item['name']
+        list_info, member_count = await asyncio.gather(self.get_list_info(list_item['id']),
+                                                       self.get_list_member_count(list_item['id']))
+        if not list_info:
+            return None
+
+        list_url = f"{INSTANCE_A_BASE_URL}{list_info['id']}{LIST_URL_SUFFIX}"
+        logger.info(f"    ✓ {list_name}: {member_count} members")
+        return LIST_KEYS[list_name], {
+            'id': list_info['id'],
+            'name': list_info['name'],
+            'memberCount': member_count,
+            'url': list_url,
+            'createdAt': list_info.get('createdAt'),
+            'updatedAt': list_info.get('updatedAt')
+        }
+
+    async def export_program_lists(self, program_id: int, program_name: str) -> Dict:
+        """Export all migration analysis lists from a program, the lists are exported concurrently"""
+        logger.info(f"\n[EXPORT] Processing program: {program_name} (ID: {program_id})")
+
+        all_lists = await self.get_program_static_lists(program_id)
+        logger.info(f"  Found {len(all_lists)} total static lists in program")
+
+        targets = [item for item in all_lists if item.get('name', '') in TARGET_LIST_NAMES]
+        exported = await asyncio.gather(*(self._export_list(item) for item in targets))
+        migration_lists = dict(x for x in exported if x is not None)
+
+        missing_lists = set(TARGET_LIST_NAMES) - set(item['name'] for item in targets)
+        if missing_lists:
+            logger.warning(f"  Missing lists: {', '.join(missing_lists)}")
+
+        return {
+            'program_id': program_id,
+            'program_name': program_name,
+            'lists_found': len(migration_lists),
+            'lists': migration_lists,
+            'missing_lists': list(missing_lists)
+        }
+
 # ============================================
 # CSV EXPORT FUNCTION
 # ============================================
@@ -448,39 +715,12 @@ def create_csv_from_results(summary: Dict, csv_filename: str):
     return len(rows)
 
 # ============================================
-# MAIN EXPORT FUNCTION
+# PROGRAM EXPORT FUNCTIONS
 # ============================================
-def export_all_program_lists():
-    """Export static list counts for all programs in data_final.json"""
-    start_time = datetime.now()
-
-    print("\n[START] Exporting Static List Counts")
-    print("=" * 60)
-
-    # Load program mappings
-    data_file = 'data_final.json'
-    if not os.path.exists(data_file):
-        # Try test file as fallback
-        data_file = 'data_test.json'
-        if not os.path.exists(data_file):
-            print(f"[ERROR] No data file found (looked for data_final.json and data_test.json)")
-            return
-
-    try:
-        with open(data_file, 'r', encoding='utf-8') as f:
-            mappings = json.load(f)
-        print(f"[SUCCESS] Loaded {len(mappings)} programs from {data_file}")
-    except Exception as e:
-        print(f"[ERROR] Failed to load {data_file}: {str(e)}")
-        return
-
-    # Initialize exporter
+def export_programs(mappings: List[Dict]) -> List[Dict]:
+    """Export the lists of every program one call at a time"""
     exporter = StaticListExporter(A_MUNCHKIN, A_CLIENT_ID, A_CLIENT_SECRET, "Source")
-
-    # Process each program
     all_results = []
-    programs_with_lists = 0
-    total_lists_found = 0
 
     for i, mapping in enumerate(mappings, 1):
         program_name = mapping.get('Program Name', 'Unknown')
@@ -501,10 +741,6 @@ def export_all_program_lists():
 
             all_results.append(result)
 
-            if result['lists_found'] > 0:
-                programs_with_lists += 1
-                total_lists_found += result['lists_found']
-
         except Exception as e:
             logger.error(f"Failed to export lists for program '{program_name}': {str(e)}")
             all_results.append({
@@ -518,6 +754,99 @@ def export_all_program_lists():
         if i < len(mappings):
             time.sleep(RATE_LIMIT_PAUSE * 2)
 
+    return all_results
+
+
+async def export_programs_async(mappings: List[Dict]) -> List[Dict]:
+    """Export the lists of every program concurrently, the results are in the same order as mappings"""
+
+    async def export_one(exporter: AsyncStaticListExporter, mapping: Dict) -> Dict:
+        program_name = mapping.get('Program Name', 'Unknown')
+        old_program_id = mapping.get('Old Program ID')
+        try:
+            result = await exporter.export_program_lists(old_program_id, program_name)
+            result['new_program_id'] = mapping.get('New Program ID')
+            return result
+        except Exception as e:
+            logger.error(f"Failed to export lists for program '{program_name}': {str(e)}")
+            return {
+                'program_id': old_program_id,
+                'program_name': program_name,
+                'error': str(e),
+                'lists_found': 0
+            }
+
+    valid = []
+    for mapping in mappings:
+        if mapping.get('Old Program ID'):
+            valid.append(mapping)
+        else:
+            logger.warning(f"Skipping program '{mapping.get('Program Name', 'Unknown')}' - no Old Program ID")
+
+    print(f"\n[ASYNC] Processing {len(valid)} programs with up to {MAX_CONCURRENT_CALLS} calls in flight")
+    async with AsyncStaticListExporter(A_MUNCHKIN, A_CLIENT_ID, A_CLIENT_SECRET, "Source") as exporter:
+        return list(await asyncio.gather(*(export_one(exporter, mapping) for mapping in valid)))
+
+def estimate_program_calls(mapping: Dict) -> Estimate:
+    """Calls expected to export the lists of one program: its list of static lists, then the info and the member
+    pages of each target list"""
+    if not mapping.get('Old Program ID'):
+        return Estimate()
+    return Estimate(calls=1 + len(TARGET_LIST_NAMES) * (1 + ESTIMATED_PAGES_PER_LIST))
+
+# ============================================
+# MAIN EXPORT FUNCTION
+# ============================================
+def export_all_program_lists():
+    """Export static list counts for all programs in data_final.json"""
+    start_time = datetime.now()
+
+    print("\n[START] Exporting Static List Counts")
+    print("=" * 60)
+
+    # Load program mappings
+    data_file = 'data_final.json'
+    if not os.path.exists(data_file):
+        # Try test file as fallback
+        data_file = 'data_test.json'
+        if not os.path.exists(data_file):
+            print(f"[ERROR] No data file found (looked for data_final.json and data_test.json)")
+            return
+
+    try:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            mappings = json.load(f)
+        print(f"[SUCCESS] Loaded {len(mappings)} programs from {data_file}")
+    except Exception as e:
+        print(f"[ERROR] Failed to load {data_file}: {str(e)}")
+        return
+
+    # Check that today's remaining API quota covers the export before making any calls (see quota_ledger.py),
+    # if it does not only the programs that fit are exported and the rest are left for a later run
+    try:
+        fits = preflight([estimate_program_calls(mapping) for mapping in mappings])
+    except QuotaExceeded as e:
+        print(f"[ERROR] Not starting the export: {str(e)}")
+        return
+    if fits < len(mappings):
+        logger.warning(f"[QUOTA] Only the first {fits} of {len(mappings)} programs fit in today's API quota, "
+                       f"run the remaining programs after the quota resets")
+        mappings = mappings[:fits]
+
+    # Latency, bytes, retries and rate limit hits of every call per endpoint, written next to the log every 15 secs
+    # (see api_metrics.py) and summarized at the end
+    metrics_path = log_filename.replace('.log', '_metrics')
+    get_metrics().start(metrics_path)
+
+    # Process each program
+    if ASYNC_EXPORT and aiohttp is not None:
+        all_results = asyncio.run(export_programs_async(mappings))
+    else:
+        all_results = export_programs(mappings)
+
+    programs_with_lists = sum(1 for result in all_results if result['lists_found'] > 0)
+    total_lists_found = sum(result['lists_found'] for result in all_results)
+
     # Generate summary statistics
     elapsed_time = datetime.now() - start_time
 
@@ -576,8 +905,13 @@ def export_all_program_lists():
     print(f"  CSV:  {csv_output_file} ({csv_rows} rows)")
     print(f"  Both files include member counts and direct URLs for each list")
     print(f"\nLog file: {log_filename}")
+    print(f"Metrics: {metrics_path}.json and {metrics_path}.prom")
     print(f"Time taken: {elapsed_time.seconds // 60} minutes {elapsed_time.seconds % 60} seconds")
 
+    # Which endpoints the run spent its time waiting on
+    get_metrics().write()
+    logger.info(f"\n[METRICS] API calls by endpoint\n{get_metrics().summary()}")
+
 # ============================================
 # ENTRY POINT
 # ============================================
@@ -1,4 +1,3 @@
-import requests
 import json
 from datetime import datetime, timedelta
 import pytz
@@ -7,6 +6,15 @@ import pandas as pd
 from io import StringIO
 from urllib.parse import parse_qs
 import phpserialize
+import os
+import sys
+
+#shared modules used by several of the scripts in this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Marketo Common'))
+
+from export_jobs import ExportJobs
+import http_session
+from token_provider import TokenProvider
 
 
 base_url = 'https://xxx-xxx-xxx.mktorest.com'
@@ -19,57 +27,31 @@ activityIds = [2,11]
 
 #-------------------------- Extracting Data Functions ------------------------
 
-def getToken ():
-    response = requests.get(base_url+'/identity/oauth/token?grant_type=client_credentials&client_id='+client_id+'&client_secret='+client_secret)
-
-    print(response.text)
-
-    temp = json.loads(response.text)
-    token = temp['access_token']
-    remaining = temp['expires_in']
+# one access token shared by the threads and processes using this API user, the next token is fetched in the
+# background as soon as the current one expires so the calls below never wait for it (see token_provider.py)
+tokens = TokenProvider(base_url, client_id, client_secret)
 
-    return [token, remaining]
+# the export jobs are recorded by their filter so a job is never created twice for the same time range, and a create
+# or enqueue call that timed out is checked instead of being sent again (see export_jobs.py)
+jobs = ExportJobs(base_url, file_path + 'export_jobs.json')
 
 def createJob(startAt, endAt, activityTypeIds, token):
 
-    url = base_url + "/bulk/v1/activities/export/create.json"
-
-    payload = json.dumps({
-        "format": 'CSV',
-        "filter": {
-            "createdAt": {
-                "startAt": startAt,
-                "endAt": endAt
-            },
-            "activityTypeIds": activityTypeIds
-        }
-    })
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer ' + token
+    export_filter = {
+        "createdAt": {
+            "startAt": startAt,
+            "endAt": endAt
+        },
+        "activityTypeIds": activityTypeIds
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    print(response.text)
+    job_id = jobs.create(export_filter, token)
 
-    temp = json.loads(response.text)
-    job_id = temp["result"][0]["exportId"]
+    print(job_id)
     return job_id
 
 def enqueueJob(jobId, token):
-    url = base_url + "/bulk/v1/activities/export/"+jobId+"/enqueue.json"
-
-    payload = ""
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer ' + token
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    print(response.text)
+    jobs.enqueue(jobId, token)
 
 def pollJob(jobId, token):
 
@@ -81,7 +63,7 @@ def pollJob(jobId, token):
         'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = http_session.request("GET", url, headers=headers, data=payload)
 
     print(response.text)
 
@@ -98,7 +80,7 @@ def getJobData(jobId, token):
         'Authorization': 'Bearer ' + token
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = http_session.request("GET", url, headers=headers, data=payload)
 
     #print(response.text)
 
@@ -139,28 +121,28 @@ def splitTimeFrame(start_date,end_date, maxDelta):
 
     return (time_pairs)
 
-def createMultipleJobs(time_pairs, token, activityIds):
+def createMultipleJobs(time_pairs, activityIds):
 
     job_ids = []
     for start_time, end_time in time_pairs:
-        job_ids.append(createJob(start_time, end_time, activityIds, token))
+        job_ids.append(createJob(start_time, end_time, activityIds, tokens.get()))
 
     return job_ids
 
-def enqueueMultipleJobs(job_ids, token):
+def enqueueMultipleJobs(job_ids):
 
     for j in job_ids:
-        enqueueJob(j, token)
+        enqueueJob(j, tokens.get())
 
-def waitWhilePolling(job_ids, token):
+def waitWhilePolling(job_ids):
 
     last_id = job_ids[-1]
-    status = pollJob(last_id,token)
+    status = pollJob(last_id, tokens.get())
     while status != "Completed":
         time.sleep(30)
-        status = pollJob(last_id, token)
+        status = pollJob(last_id, tokens.get())
 
-def getMultipleJobs(job_ids,token):
+def getMultipleJobs(job_ids):
     headers = [
         'marketoGUID',
         'leadId',
@@ -175,7 +157,7 @@ def getMultipleJobs(job_ids,token):
     df = pd.DataFrame(columns=headers)
 
     for j in job_ids:
-        raw_data = getJobData(j, token)
+        raw_data = getJobData(j, tokens.get())
         new_data = pd.read_csv(StringIO(raw_data))
         df = pd.concat([df, new_data], ignore_index=True)
 
@@ -185,23 +167,15 @@ def getActivityOverRange(activityID):
     # Get start and end time pairs needed to create each job
     time_pairs = splitTimeFrame(start_date, end_date, 31)
 
-    # Get an access token and make sure it has more than 6o secs of life
-    remaining = 0
-    while remaining < 60:
-        time.sleep(remaining)  # if the remaining time is less than 60 secs then wait for the token to expire before getting a new one
-        temp = getToken()
-        token = temp[0]
-        remaining = temp[1]
-
     # create jobs for each time pair
-    job_ids = createMultipleJobs(time_pairs, token, [activityID])
+    job_ids = createMultipleJobs(time_pairs, [activityID])
 
     # queue jobs & wait until job data is ready
-    enqueueMultipleJobs(job_ids, token)
-    waitWhilePolling(job_ids, token)
+    enqueueMultipleJobs(job_ids)
+    waitWhilePolling(job_ids)
 
     # get the job data for each job and join together
-    df = getMultipleJobs(job_ids, token)
+    df = getMultipleJobs(job_ids)
 
     return df
 